@@ -0,0 +1,486 @@
+#! /usr/bin/env python3
+
+import sys
+import os
+import argparse
+import json
+import time
+import gzip
+import random
+import resource
+import tempfile
+import timeit
+
+from oor_mapper import (
+    mapper,
+    json_codec,
+    input_reader,
+    memory_merge_store,
+    sqlite_merge_store,
+    output_writer,
+    quarantine_writer,
+    run_metrics,
+    map_rows,
+    finish_record,
+    add_mapping_arguments,
+)
+
+
+# =========================
+class statement_generator:  # pylint: disable=too-many-instance-attributes
+
+    # produces a seeded, register like mix of entity, person and ownership
+    # statements, including forward references, orphaned subjects, multiple
+    # interests and replaced statements
+    def __init__(self, seed=1, entity_ratio=0.35, person_ratio=0.3):
+        self.rng = random.Random(seed)
+        self.entity_ratio = entity_ratio
+        self.person_ratio = person_ratio
+        self.entity_ids = []
+        self.person_ids = []
+        self.ownership_ids = []
+        self.pending_ids = []
+        self.id_schemes = [
+            ("GB-COH", "Companies House"),
+            ("DK-CVR", "Denmark Central Business Register"),
+            ("SK-ORSR", "Slovakia Companies Register"),
+            ("UA-EDR", "Ukraine Consolidated State Registry"),
+            ("MISC-Denmark CVR", "DK Centrale Virksomhedsregister"),
+            ("XI-LEI", "Global Legal Entity Identifier Index"),
+            ("", "Unknown Register"),
+        ]
+        self.interest_types = [
+            "shareholding",
+            "voting-rights",
+            "appointment-of-board",
+            "influence-or-control",
+            "other-influence-or-control",
+            "",
+        ]
+        self.countries = ["GB", "DK", "SK", "UA", "US", "DE", ""]
+
+    def new_id(self):
+        return f"openownership-register-{self.rng.getrandbits(63)}"
+
+    def get_date(self, start_year=1950, end_year=2023):
+        year = self.rng.randint(start_year, end_year)
+        return f"{year}-{self.rng.randint(1, 12):02d}-{self.rng.randint(1, 28):02d}"
+
+    def get_addresses(self):
+        address_list = []
+        for _ in range(self.rng.choice([0, 1, 1, 1, 2])):
+            addr_data = {
+                "type": self.rng.choice(["registered", "service", "residence"]),
+                "address": f"{self.rng.randint(1, 999)} High Street, Town {self.rng.randint(1, 5000)}",
+            }
+            country = self.rng.choice(self.countries)
+            if country:
+                addr_data["country"] = country
+            address_list.append(addr_data)
+        return address_list
+
+    def get_identifiers(self, statement_id):
+        identifiers = [
+            {
+                "schemeName": "OpenOwnership Register",
+                "id": statement_id,
+                "uri": f"/entities/{self.rng.getrandbits(48):012x}",
+            }
+        ]
+        for _ in range(self.rng.choice([0, 1, 1, 2])):
+            scheme, scheme_name = self.rng.choice(self.id_schemes)
+            id_data = {
+                "schemeName": scheme_name,
+                "id": str(self.rng.randint(1, 99999999)),
+            }
+            if scheme:
+                id_data["scheme"] = scheme
+            identifiers.append(id_data)
+        return identifiers
+
+    def get_replaces(self, id_list):
+        if id_list and self.rng.random() < 0.02:
+            return {"replacesStatements": [self.rng.choice(id_list)]}
+        return {}
+
+    def get_entity(self):
+        statement_id = self.pending_ids.pop() if self.pending_ids else self.new_id()
+        raw_data = {
+            "statementID": statement_id,
+            "statementType": "entityStatement",
+            "statementDate": self.get_date(2015),
+            "entityType": "registeredEntity",
+            "name": f"Company {self.rng.randint(1, 10000000)} Limited",
+            "incorporatedInJurisdiction": {"code": self.rng.choice(self.countries)},
+            "identifiers": self.get_identifiers(statement_id),
+            "addresses": self.get_addresses(),
+            "foundingDate": self.get_date(),
+        }
+        if self.rng.random() < 0.1:
+            raw_data["alternateNames"] = [f"Trading Name {self.rng.randint(1, 99999)}"]
+        if self.rng.random() < 0.05:
+            raw_data["dissolutionDate"] = self.get_date(2000)
+        raw_data.update(self.get_replaces(self.entity_ids))
+        self.entity_ids.append(statement_id)
+        return raw_data
+
+    def get_person(self):
+        statement_id = self.new_id()
+        name_list = [
+            {
+                "type": "individual",
+                "fullName": f"Person {self.rng.randint(1, 10000000)}",
+            }
+        ]
+        if self.rng.random() < 0.2:
+            name_list.append(
+                {"type": "birth_name", "fullName": f"Birth {self.rng.randint(1, 9999)}"}
+            )
+        raw_data = {
+            "statementID": statement_id,
+            "statementType": "personStatement",
+            "statementDate": self.get_date(2015),
+            "personType": "knownPerson",
+            "names": name_list,
+            "nationalities": [{"code": self.rng.choice(self.countries[:-1])}],
+            "birthDate": f"{self.rng.randint(1930, 2000)}-{self.rng.randint(1, 12):02d}",
+            "addresses": self.get_addresses(),
+            "identifiers": self.get_identifiers(statement_id),
+        }
+        raw_data.update(self.get_replaces(self.person_ids))
+        self.person_ids.append(statement_id)
+        return raw_data
+
+    def get_ownership(self):
+        roll = self.rng.random()
+        if roll < 0.01 or not self.entity_ids:
+            subject_id = self.new_id()  # never described, an orphan
+        elif roll < 0.05:
+            subject_id = self.new_id()  # described later, a forward reference
+            self.pending_ids.append(subject_id)
+        else:
+            subject_id = self.rng.choice(self.entity_ids[-1000:])
+
+        roll = self.rng.random()
+        if roll < 0.7 and self.person_ids:
+            interested_party = {
+                "describedByPersonStatement": self.rng.choice(self.person_ids)
+            }
+        elif roll < 0.95 and self.entity_ids:
+            interested_party = {
+                "describedByEntityStatement": self.rng.choice(self.entity_ids)
+            }
+        else:
+            interested_party = {"unspecified": {"reason": "unknown"}}
+
+        interests = []
+        for _ in range(self.rng.choice([0, 1, 1, 1, 2, 3])):
+            interest_data = {"type": self.rng.choice(self.interest_types)}
+            if interest_data["type"] in ("shareholding", "voting-rights"):
+                if self.rng.random() < 0.5:
+                    interest_data["share"] = {
+                        "exact": self.rng.choice([25, 50, 75, 100])
+                    }
+                else:
+                    minimum = self.rng.choice([25, 50, 75])
+                    interest_data["share"] = {
+                        "minimum": minimum,
+                        "maximum": minimum + 25,
+                    }
+            if self.rng.random() < 0.8:
+                interest_data["startDate"] = self.get_date(2000)
+            if self.rng.random() < 0.1:
+                interest_data["endDate"] = self.get_date(2016)
+            interests.append(interest_data)
+
+        statement_id = self.new_id()
+        raw_data = {
+            "statementID": statement_id,
+            "statementType": "ownershipOrControlStatement",
+            "statementDate": self.get_date(2015),
+            "subject": {"describedByEntityStatement": subject_id},
+            "interestedParty": interested_party,
+            "interests": interests,
+        }
+        raw_data.update(self.get_replaces(self.ownership_ids))
+        self.ownership_ids.append(statement_id)
+        return raw_data
+
+    def get_statements(self, row_count):
+        for _ in range(row_count):
+            roll = self.rng.random()
+            if roll < self.entity_ratio:
+                yield self.get_entity()
+            elif roll < self.entity_ratio + self.person_ratio:
+                yield self.get_person()
+            else:
+                yield self.get_ownership()
+
+
+def write_statements(file_name, row_count, seed=1, entity_ratio=0.35, person_ratio=0.3):
+    generator = statement_generator(seed, entity_ratio, person_ratio)
+    open_function = gzip.open if file_name.endswith(".gz") else open
+    with open_function(file_name, "wt", encoding="utf-8") as outfile:
+        for raw_data in generator.get_statements(row_count):
+            outfile.write(json.dumps(raw_data) + "\n")
+
+
+def get_peak_rss_mb():
+    # ru_maxrss is in kilobytes on linux and bytes on macos
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        peak_rss = peak_rss / 1024
+    return round(peak_rss / 1024, 1)
+
+
+def run_pipeline(input_file, temp_dir, args):
+    # the mapper's own reading, mapping, merging and writing, with the read,
+    # decode and map stages timed per chunk of rows by map_rows
+    codec = json_codec(args.json_backend)
+    record_mapper = mapper(args.stats_level, prune_empty=not args.keep_empty_values)
+    if args.merge_store == "sqlite":
+        merge_store = sqlite_merge_store(temp_dir=temp_dir, codec=codec)
+    else:
+        merge_store = memory_merge_store()
+    metrics = run_metrics(os.path.join(temp_dir, "metrics.jsonl"))
+    quarantine = quarantine_writer(os.path.join(temp_dir, "quarantine.jsonl"))
+
+    row_count = 0
+    file_reader = input_reader(input_file, read_ahead_mb=args.read_ahead_mb)
+    mapped_rows = map_rows(
+        file_reader,
+        record_mapper,
+        codec,
+        workers=args.workers,
+        chunk_size=args.chunk_size,
+        metrics=metrics,
+    )
+    for mapped_list, _, error_list in mapped_rows:
+        quarantine.write(error_list)
+        row_count += len(mapped_list)
+        start_time = time.perf_counter()
+        for json_data in mapped_list:
+            if json_data:
+                merge_store.add(json_data)
+        metrics.add_time("merge", time.perf_counter() - start_time)
+    file_reader.close()
+    quarantine.close()
+
+    start_time = time.perf_counter()
+    output_file_name = os.path.join(temp_dir, "output.jsonl")
+    output_file = output_writer(output_file_name, codec)
+    for json_data in merge_store.get_records():
+        if finish_record(record_mapper, json_data):
+            output_file.write(json_data)
+    output_file.close()
+    merge_store.close()
+    metrics.add_time("write", time.perf_counter() - start_time)
+
+    return (
+        row_count,
+        output_file.row_count,
+        os.path.getsize(output_file_name),
+        quarantine.error_count,
+        metrics.stage_times,
+    )
+
+
+def run_micro_benchmarks(input_file, args, call_count=10000):
+    # per call timings of the mapper's hot functions on a sample of the input
+    codec = json_codec(args.json_backend)
+    record_mapper = mapper(args.stats_level, prune_empty=not args.keep_empty_values)
+    # pruning while the record is built against the remove_empty_tags walk
+    pruning_mapper = mapper(args.stats_level, prune_empty=True)
+    keeping_mapper = mapper(args.stats_level, prune_empty=False)
+    samples = {
+        "entityStatement": [],
+        "personStatement": [],
+        "ownershipOrControlStatement": [],
+    }
+    for line in input_reader(input_file, read_ahead_mb=0):
+        raw_data = codec.decode(line)
+        sample_list = samples.get(raw_data.get("statementType"))
+        if sample_list is not None and len(sample_list) < 1000:
+            sample_list.append(raw_data)
+        if all(len(x) == 1000 for x in samples.values()):
+            break
+
+    mapped_list = [
+        record_mapper.map(x)
+        for x in samples["entityStatement"] + samples["personStatement"]
+    ]
+    function_list = {
+        "map_entity": (samples["entityStatement"], record_mapper.map),
+        "map_person": (samples["personStatement"], record_mapper.map),
+        "map_relationship": (
+            samples["ownershipOrControlStatement"],
+            lambda x: record_mapper.map_relationship(
+                x, {"DATA_SOURCE": "OPEN-OWNERSHIP"}
+            ),
+        ),
+        "remove_empty_tags": (mapped_list, record_mapper.remove_empty_tags),
+        "map_then_prune": (
+            samples["entityStatement"] + samples["personStatement"],
+            lambda x: keeping_mapper.remove_empty_tags(keeping_mapper.map(x)),
+        ),
+        "map_pruned": (
+            samples["entityStatement"] + samples["personStatement"],
+            pruning_mapper.map,
+        ),
+        "encode": (mapped_list, codec.encode),
+    }
+    results = {}
+    for function_name, (sample_list, function) in function_list.items():
+        if not sample_list:
+            continue
+        calls = [sample_list[x % len(sample_list)] for x in range(call_count)]
+        start_time = timeit.default_timer()
+        for raw_data in calls:
+            function(raw_data)
+        elapsed = timeit.default_timer() - start_time
+        results[function_name] = round(call_count / elapsed)
+    return results
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        description="measures the mapper on a register file or generated statements"
+    )
+    parser.add_argument(
+        "-i",
+        "--input_file",
+        dest="input_file",
+        help="optional statements file to benchmark, defaults to generating one",
+    )
+    parser.add_argument(
+        "-n",
+        "--row_count",
+        dest="row_count",
+        type=int,
+        default=100000,
+        help="number of statements to generate, defaults to 100,000",
+    )
+    parser.add_argument(
+        "--seed",
+        dest="seed",
+        type=int,
+        default=1,
+        help="random seed for the generated statements, defaults to 1",
+    )
+    parser.add_argument(
+        "--entity_ratio",
+        dest="entity_ratio",
+        type=float,
+        default=0.35,
+        help="share of generated statements that are entities, defaults to 0.35",
+    )
+    parser.add_argument(
+        "--person_ratio",
+        dest="person_ratio",
+        type=float,
+        default=0.3,
+        help="share of generated statements that are persons, defaults to 0.3, the rest are ownership statements",
+    )
+    parser.add_argument(
+        "-g",
+        "--generate_only",
+        dest="generate_file",
+        help="only write the generated statements to this file, .gz to compress",
+    )
+    add_mapping_arguments(parser)
+    parser.add_argument(
+        "-r",
+        "--report_file",
+        dest="report_file",
+        help="optional file to write the results to as json",
+    )
+    args = parser.parse_args()
+
+    if args.generate_file:
+        write_statements(
+            args.generate_file,
+            args.row_count,
+            args.seed,
+            args.entity_ratio,
+            args.person_ratio,
+        )
+        print(f"{args.row_count:,} statements written to {args.generate_file}")
+        sys.exit(0)
+
+    with tempfile.TemporaryDirectory(prefix="oor_benchmark_") as temp_dir:
+        input_file = args.input_file
+        if not input_file:
+            input_file = os.path.join(temp_dir, "statements.jsonl.gz")
+            start_time = time.perf_counter()
+            write_statements(
+                input_file,
+                args.row_count,
+                args.seed,
+                args.entity_ratio,
+                args.person_ratio,
+            )
+            print(
+                f"{args.row_count:,} statements generated in {time.perf_counter() - start_time:.1f} seconds"
+            )
+
+        start_time = time.perf_counter()
+        (
+            input_row_count,
+            output_row_count,
+            output_bytes,
+            error_count,
+            stage_times,
+        ) = run_pipeline(input_file, temp_dir, args)
+        total_time = time.perf_counter() - start_time
+        peak_rss_mb = get_peak_rss_mb()
+        calls_per_second = run_micro_benchmarks(input_file, args)
+
+    report = {
+        "input_file": args.input_file,
+        "row_count": input_row_count,
+        "records_written": output_row_count,
+        "output_bytes": output_bytes,
+        "error_count": error_count,
+        "seed": args.seed,
+        "merge_store": args.merge_store,
+        "workers": args.workers,
+        "chunk_size": args.chunk_size,
+        "json_backend": json_codec(args.json_backend).backend,
+        "stats_level": args.stats_level,
+        "keep_empty_values": args.keep_empty_values,
+        "total_seconds": round(total_time, 3),
+        "rows_per_second": round(input_row_count / total_time),
+        "peak_rss_mb": peak_rss_mb,
+        "stages": {
+            x: {
+                "seconds": round(y, 3),
+                "rows_per_second": round(input_row_count / y) if y else None,
+            }
+            for x, y in stage_times.items()
+        },
+        "calls_per_second": calls_per_second,
+    }
+
+    print(f"\n{'stage':<20}{'seconds':>10}{'rows/sec':>14}")
+    for stage, stage_data in report["stages"].items():
+        print(
+            f"{stage:<20}{stage_data['seconds']:>10.2f}{stage_data['rows_per_second'] or 0:>14,}"
+        )
+    print(
+        f"{'total':<20}{report['total_seconds']:>10.2f}{report['rows_per_second']:>14,}"
+    )
+    print(f"\npeak rss {peak_rss_mb:,} MB")
+    print(f"output {output_bytes:,} bytes")
+    print(f"{error_count:,} rows could not be mapped\n")
+    print(f"{'function':<20}{'calls/sec':>24}")
+    for function_name, calls in calls_per_second.items():
+        print(f"{function_name:<20}{calls:>24,}")
+    print()
+
+    if args.report_file:
+        with open(args.report_file, "w") as outfile:
+            json.dump(report, outfile, indent=4)
+        print("Benchmark report written to %s\n" % args.report_file)
+
+    sys.exit(0)
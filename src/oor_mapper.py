@@ -1,4 +1,5 @@
 #! /usr/bin/env python3
+# pylint: disable=too-many-lines
 
 import sys
 import os
@@ -8,28 +9,185 @@ import time
 import signal
 import gzip
 import io
+import sqlite3
+import tempfile
+import multiprocessing
+import pickle
+import hashlib
+import queue
+import threading
+import zlib
+import glob
+import random
+import collections
+import csv
+import re
+import math
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    from senzing import G2Engine, G2Exception
+except ImportError:
+    G2Engine = None
+    G2Exception = None
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
 
 
 # =========================
-class mapper:
+class mapping_error(Exception):
 
-    def __init__(self):
+    # a statement that cannot be mapped, quarantined under its reason
+    def __init__(self, reason, message=None):
+        super().__init__(message or reason)
+        self.reason = reason
 
-        self.stat_pack = {}
-        self.conversions = {}
-        self.conversions["ADDR_TYPE"] = {"personStatement": {}, "entityStatement": {}}
-        self.conversions["ADDR_TYPE"]["personStatement"]["REGISTERED"] = "PRIMARY"
-        self.conversions["ADDR_TYPE"]["entityStatement"]["REGISTERED"] = "BUSINESS"
-        self.conversions["ID_TYPE"] = {}
-        self.conversions["ID_TYPE"]["DK-CVR"] = ["NATIONAL_ID", "DNK"]
-        self.conversions["ID_TYPE"]["GB-COH"] = ["NATIONAL_ID", "GBR"]
-        self.conversions["ID_TYPE"]["SK-ORSR"] = ["NATIONAL_ID", "SVK"]
-        self.conversions["ID_TYPE"]["UA-EDR"] = ["NATIONAL_ID", "UKR"]
-        self.conversions["ID_TYPE"]["MISC-DENMARK CVR"] = ["NATIONAL_ID", "DNK"]
-        self.conversions["ID_TYPE"]["MISC-SLOVAKIA PSP REGISTER"] = [
-            "NATIONAL_ID",
-            "SVK",
-        ]
+
+# =========================
+class load_error(Exception):
+
+    # a record the loader could not add or delete, retried by the loader_sink
+    pass
+
+
+def load_conversions(file_name=None):
+    # the conversion tables are checked and compiled once at startup, every
+    # mapper and worker then shares the result
+    if not file_name:
+        file_name = os.path.join(
+            os.path.dirname(os.path.abspath(__file__)), "oor_conversions.json"
+        )
+    with open(file_name, "r", encoding="utf-8") as infile:
+        table_data = json.load(infile)
+
+    def check(condition, message):
+        if not condition:
+            raise ValueError(f"{file_name}: {message}")
+
+    def is_str_map(value):
+        return isinstance(value, dict) and all(
+            isinstance(x, str) and isinstance(y, str) for x, y in value.items()
+        )
+
+    def check_identifier(id_data, where):
+        check(
+            isinstance(id_data, dict)
+            and isinstance(id_data.get("senzing_attr"), str)
+            and id_data["senzing_attr"].isupper()
+            and isinstance(id_data.get("country", ""), str),
+            f"{where} needs an upper case senzing_attr and an optional country",
+        )
+        return (id_data["senzing_attr"], id_data.get("country", ""))
+
+    check(isinstance(table_data, dict), "expected a json object")
+    for key in (
+        "address_types",
+        "identifier_schemes",
+        "default_identifier",
+        "roles",
+        "link_prefixes",
+    ):
+        check(key in table_data, f"{key} is missing")
+
+    conversions = {}
+    conversions["ADDR_TYPE"] = {"personStatement": {}, "entityStatement": {}}
+    for statement_type, type_map in table_data["address_types"].items():
+        check(
+            statement_type in conversions["ADDR_TYPE"],
+            f"address_types has an unknown statement type {statement_type}",
+        )
+        check(is_str_map(type_map), f"address_types {statement_type} is not a map")
+        conversions["ADDR_TYPE"][statement_type] = {
+            x.upper(): y for x, y in type_map.items()
+        }
+
+    check(
+        isinstance(table_data["identifier_schemes"], dict),
+        "identifier_schemes is not a map",
+    )
+    conversions["ID_TYPE"] = {
+        x: check_identifier(y, f"identifier_schemes {x}")
+        for x, y in table_data["identifier_schemes"].items()
+    }
+    conversions["DEFAULT_ID_TYPE"] = check_identifier(
+        table_data["default_identifier"], "default_identifier"
+    )
+
+    roles = table_data["roles"]
+    check(
+        isinstance(roles, dict)
+        and isinstance(roles.get("default"), str)
+        and is_str_map(roles.get("replace", {}))
+        and is_str_map(roles.get("names", {})),
+        "roles needs a default and optional replace and names maps",
+    )
+    conversions["ROLE_DEFAULT"] = roles["default"]
+    conversions["ROLE_REPLACE"] = list(roles.get("replace", {}).items())
+    conversions["ROLE_NAMES"] = roles.get("names", {})
+
+    conversions["LINK_PREFIX"] = {}
+    check(isinstance(table_data["link_prefixes"], list), "link_prefixes is not a list")
+    for link_data in table_data["link_prefixes"]:
+        check(
+            is_str_map(link_data)
+            and {"scheme_name", "starts_with", "prefix"} <= link_data.keys(),
+            "link_prefixes need a scheme_name, starts_with and prefix",
+        )
+        conversions["LINK_PREFIX"].setdefault(link_data["scheme_name"], []).append(
+            (link_data["starts_with"], link_data["prefix"])
+        )
+    return conversions
+
+
+def has_value(value):
+    # what remove_empty_tags keeps, without turning lists and dicts into strings
+    if value is None:
+        return False
+    if isinstance(value, str):
+        return not value.isspace() and value != ""
+    return True
+
+
+# =========================
+class mapper:  # pylint: disable=too-many-instance-attributes
+
+    statement_types = (
+        "entityStatement",
+        "personStatement",
+        "ownershipOrControlStatement",
+    )
+
+    def __init__(  # pylint: disable=too-many-arguments,too-many-positional-arguments
+        self,
+        stats_level="full",
+        dedup_relationships=True,
+        collapse_replaced=False,
+        conversions=None,
+        prune_empty=True,
+    ):
+
+        # none skips all statistics, basic keeps alerts and record counts, full
+        # also counts every raw and mapped attribute
+        self.dedup_relationships = dedup_relationships
+        self.collapse_replaced = collapse_replaced
+        # blank attributes are left out as the records are built, the same as
+        # running remove_empty_tags over them
+        self.prune_empty = prune_empty
+        self.stats_level = stats_level
+        self.raw_stats = stats_level == "full"
+        self.reset_stats()
+        self.conversions = conversions if conversions else load_conversions()
+        # per scheme and interest type decisions, filled in as they are first seen
+        self.identifier_cache = {}
+        self.role_cache = {}
 
     def map(self, raw_data, input_row_num=None):
         json_data = {}
@@ -39,55 +197,86 @@ class mapper:
         json_data["DATA_SOURCE"] = "OPEN-OWNERSHIP"
         if statement_type == "entityStatement":
             json_data["RECORD_ID"] = raw_data["statementID"]
-            json_data["STATEMENT_DATE"] = raw_data["statementDate"]
+            if self.keep_value(raw_data["statementDate"]):
+                json_data["STATEMENT_DATE"] = raw_data["statementDate"]
             json_data["RECORD_TYPE"] = "ORGANIZATION"
             json_data = self.map_entity(raw_data, json_data)
 
         elif statement_type == "personStatement":
             json_data["RECORD_ID"] = raw_data["statementID"]
-            json_data["STATEMENT_DATE"] = raw_data["statementDate"]
+            if self.keep_value(raw_data["statementDate"]):
+                json_data["STATEMENT_DATE"] = raw_data["statementDate"]
             json_data["RECORD_TYPE"] = "PERSON"
             json_data = self.map_person(raw_data, json_data)
 
         elif statement_type == "ownershipOrControlStatement":
             json_data = self.map_relationship(raw_data, json_data)
 
-        for attr in raw_data.keys():
-            mapper.update_stat("!raw", "statement_attrs", statement_type, attr)
+        else:
+            raise mapping_error(
+                "unknown-statement-type",
+                f"statementType {statement_type} is not mapped",
+            )
+
+        if not json_data.get("RECORD_ID"):
+            raise mapping_error("missing-record-id", "the record has no RECORD_ID")
+
+        if self.raw_stats:
+            for attr in raw_data.keys():
+                self.update_stat("!raw", "statement_attrs", statement_type, attr)
 
         if raw_data.get("replacesStatements"):
-            json_data["replaces_statements"] = [
-                {"statementID": x} for x in raw_data.get("replacesStatements")
-            ]
             if statement_type == "ownershipOrControlStatement":
-                input(json.dumps(raw_data, indent=4))
-                mapper.update_stat(
+                # superseded relationships are not records, they only change the subject
+                self.update_stat(
                     "!alert",
                     "ownershipOrControlStatement-replaced!",
-                    value=rel_pointer_key,
+                    value=json_data.get("RECORD_ID"),
                 )
+                json_data["replaced_ownership_statements"] = list(
+                    raw_data.get("replacesStatements")
+                )
+            else:
+                json_data["replaces_statements"] = [
+                    {"statementID": x} for x in raw_data.get("replacesStatements")
+                ]
 
         return json_data
 
+    def get_record_id(self, raw_data):
+        # the RECORD_ID a statement is merged into, without mapping it
+        if raw_data.get("statementType") == "ownershipOrControlStatement":
+            return raw_data["subject"]["describedByEntityStatement"]
+        return raw_data["statementID"]
+
     def map_entity(self, raw_data, json_data):
-        json_data["NAMES"] = [{"PRIMARY_NAME_ORG": raw_data.get("name")}]
+        json_data["NAMES"] = []
+        if self.keep_value(raw_data.get("name")):
+            json_data["NAMES"].append({"PRIMARY_NAME_ORG": raw_data.get("name")})
         if raw_data.get("alternateNames"):
             for name_value in raw_data.get("alternateNames"):
-                json_data["NAMES"].append({"ALTERNATE_NAME_FULL": name_value})
+                if self.keep_value(name_value):
+                    json_data["NAMES"].append({"ALTERNATE_NAME_FULL": name_value})
+        if not json_data["NAMES"]:
+            del json_data["NAMES"]
 
-        if raw_data.get("foundingDate"):
-            json_data["REGISTRATION_DATE"] = raw_data.get("foundingDate")
+        founding_date = raw_data.get("foundingDate")
+        if founding_date and self.keep_value(founding_date):
+            json_data["REGISTRATION_DATE"] = founding_date
 
-        if raw_data.get("dissolutionDate"):
-            json_data["dissolutionDate"] = raw_data.get("dissolutionDate")
+        dissolution_date = raw_data.get("dissolutionDate")
+        if dissolution_date and self.keep_value(dissolution_date):
+            json_data["dissolutionDate"] = dissolution_date
 
         if raw_data.get("incorporatedInJurisdiction"):
-            json_data["REGISTRATION_COUNTRY"] = raw_data.get(
-                "incorporatedInJurisdiction"
-            ).get("code")
+            country_code = raw_data.get("incorporatedInJurisdiction").get("code")
+            if self.keep_value(country_code):
+                json_data["REGISTRATION_COUNTRY"] = country_code
 
         if raw_data.get("addresses"):
-            json_data["ADDRESSES"] = self.map_addresses(raw_data)
+            address_list = self.map_addresses(raw_data)
+            if address_list or not self.prune_empty:
+                json_data["ADDRESSES"] = address_list
 
         if raw_data.get("identifiers"):
             identifiers, links = self.map_identifiers(raw_data)
@@ -107,9 +296,10 @@ class mapper:
         json_data["NAMES"] = []
         for name_data in raw_data.get("names", []):
             name_value = name_data.get("fullName")
-            if name_value:
+            if name_value and self.keep_value(name_value):
                 raw_name_type = name_data.get("type", "ALTERNATE").replace("_", "-")
-                mapper.update_stat("!raw", "name_type", "PERSON", raw_name_type)
+                if self.raw_stats:
+                    self.update_stat("!raw", "name_type", "PERSON", raw_name_type)
                 if "PRIMARY_NAME_FULL" not in json_data:
                     json_data["PRIMARY_NAME_FULL"] = name_value
                 else:
@@ -117,21 +307,27 @@ class mapper:
                         {f"{raw_name_type}_NAME_FULL": name_value}
                     )
 
-        if raw_data.get("personType"):
-            json_data["personType"] = raw_data.get("personType")
+        person_type = raw_data.get("personType")
+        if person_type and self.keep_value(person_type):
+            json_data["personType"] = person_type
 
         if raw_data.get("birthDate") or raw_data.get("nationalities"):
             json_data["ATTRIBUTES"] = []
             for nationality_data in raw_data.get("nationalities", []):
-                json_data["ATTRIBUTES"].append(
-                    {"NATIONALITY": nationality_data.get("code")}
-                )
+                if self.keep_value(nationality_data.get("code")):
+                    json_data["ATTRIBUTES"].append(
+                        {"NATIONALITY": nationality_data.get("code")}
+                    )
+            if not json_data["ATTRIBUTES"] and self.prune_empty:
+                del json_data["ATTRIBUTES"]
 
-            if raw_data.get("birthDate"):
+            if raw_data.get("birthDate") and self.keep_value(raw_data.get("birthDate")):
                 json_data["DATE_OF_BIRTH"] = raw_data.get("birthDate")
 
         if raw_data.get("addresses"):
-            json_data["ADDRESSES"] = self.map_addresses(raw_data)
+            address_list = self.map_addresses(raw_data)
+            if address_list or not self.prune_empty:
+                json_data["ADDRESSES"] = address_list
 
         if raw_data.get("identifiers"):
             identifiers, links = self.map_identifiers(raw_data)
@@ -143,6 +339,8 @@ class mapper:
         json_data["RELATIONSHIPS"] = [
             {"REL_ANCHOR_DOMAIN": "OOR", "REL_ANCHOR_KEY": raw_data["statementID"]}
         ]
+        if not json_data["NAMES"] and self.prune_empty:
+            del json_data["NAMES"]
 
         return json_data
 
@@ -160,12 +358,16 @@ class mapper:
             )
         else:
             rel_pointer_key = "unknown"
+        rel_pointer_key = sys.intern(rel_pointer_key)
 
+        # the statement id is only needed to collapse replaced statements
+        statement_id = raw_data.get("statementID") if self.collapse_replaced else None
         relationship_list = []
-        for interest_data in raw_data.get("interests"):
-            rel_pointer_role = interest_data.get("type", "interested party").replace(
-                "-", "_"
-            )
+        for interest_data in raw_data.get("interests") or []:
+            interest_type = interest_data.get("type", self.conversions["ROLE_DEFAULT"])
+            if not self.keep_value(interest_type):
+                interest_type = self.conversions["ROLE_DEFAULT"]
+            rel_pointer_role = self.get_role(interest_type)
             if interest_data.get("share"):
                 exact = interest_data.get("share").get("exact", 0)
                 minimum = interest_data.get("share").get("minimum", exact)
@@ -178,29 +380,38 @@ class mapper:
                     if interest_data.get("share").get("maximum"):
                         rel_pointer_role += f" {round(maximum,2)}%"
 
-            relationship = {
-                "REL_POINTER_DOMAIN": "OOR",
-                "REL_POINTER_KEY": rel_pointer_key,
-                "REL_POINTER_ROLE": rel_pointer_role,
-            }
-            if interest_data.get("startDate"):
-                relationship["REL_POINTER_FROM_DATE"] = interest_data.get("startDate")
-            if interest_data.get("endDate"):
-                relationship["REL_POINTER_THRU_DATE"] = interest_data.get("endDate")
-            relationship_list.append(relationship)
+            from_date = interest_data.get("startDate")
+            thru_date = interest_data.get("endDate")
+            # the dates are part of the key relationships are consolidated on
+            for date in (from_date, thru_date):
+                if date is not None and not isinstance(date, str):
+                    raise mapping_error(
+                        "invalid-date", f"interest date {date!r} is not a string"
+                    )
+            relationship_list.append(
+                rel_pointer(
+                    rel_pointer_key,
+                    sys.intern(rel_pointer_role),
+                    from_date if self.keep_value(from_date) else None,
+                    thru_date if self.keep_value(thru_date) else None,
+                    statement_id,
+                )
+            )
 
         if not relationship_list:  # actually happens often: no interests section
             relationship_list.append(
-                {
-                    "REL_POINTER_DOMAIN": "OOR",
-                    "REL_POINTER_KEY": rel_pointer_key,
-                    "REL_POINTER_ROLE": "interested party",
-                }
+                rel_pointer(
+                    rel_pointer_key,
+                    self.conversions["ROLE_DEFAULT"],
+                    None,
+                    None,
+                    statement_id,
+                )
             )
 
         json_data["RELATIONSHIPS"] = relationship_list
         if not relationship_list:
-            mapper.update_stat(
+            self.update_stat(
                 "!alert", "no-relationship-interests!", value=rel_pointer_key
             )
         return json_data
@@ -210,25 +421,33 @@ class mapper:
         address_list = []
         for addr_data in raw_data.get("addresses", []):
             addr_full = addr_data.get("address")
-            if addr_full:
+            if addr_full and self.keep_value(addr_full):
                 addr_country = addr_data.get("country", "")
                 raw_addr_type = addr_data.get("type", "unknown").upper()
-                mapper.update_stat(
-                    "!raw",
-                    "address_type",
-                    raw_data.get("statementType", "none"),
-                    raw_addr_type,
-                )
+                if self.raw_stats:
+                    self.update_stat(
+                        "!raw",
+                        "address_type",
+                        raw_data.get("statementType", "none"),
+                        raw_addr_type,
+                    )
                 addr_type = self.conversions["ADDR_TYPE"][statement_type].get(
                     raw_addr_type, raw_addr_type
                 )
-                address_list.append(
-                    {
+                if self.prune_empty:
+                    address = {}
+                    if has_value(addr_type):
+                        address["ADDR_TYPE"] = addr_type
+                    address["ADDR_FULL"] = addr_full
+                    if has_value(addr_country):
+                        address["ADDR_COUNTRY"] = addr_country
+                else:
+                    address = {
                         "ADDR_TYPE": addr_type,
                         "ADDR_FULL": addr_full,
                         "ADDR_COUNTRY": addr_country,
                     }
-                )
+                address_list.append(address)
         return address_list
 
     def map_identifiers(self, raw_data):
@@ -240,46 +459,130 @@ class mapper:
             scheme = id_data.get("scheme", "")
             schemeName = id_data.get("schemeName", "")
             if id_uri:
-                mapper.update_stat(
-                    "!raw",
-                    "link",
-                    raw_data.get("statementType", "none"),
-                    f"{schemeName}|{scheme}",
-                    value=id_value,
-                )
-                if schemeName == "OpenOwnership Register" and id_uri.startswith(
-                    "/entities"
+                if self.raw_stats:
+                    self.update_stat(
+                        "!raw",
+                        "link",
+                        raw_data.get("statementType", "none"),
+                        f"{schemeName}|{scheme}",
+                        value=id_value,
+                    )
+                for starts_with, prefix in self.conversions["LINK_PREFIX"].get(
+                    schemeName, ()
                 ):
-                    id_uri = "https://register.openownership.org" + id_uri
-                links.append({schemeName: id_uri})
+                    if id_uri.startswith(starts_with):
+                        id_uri = prefix + id_uri
+                        break
+                if self.keep_value(id_uri):
+                    links.append({schemeName: id_uri})
             else:
-                senzing_attr, country = self.conversions["ID_TYPE"].get(
-                    scheme, ("NATIONAL_ID", "")
-                )
-                mapper.update_stat(
-                    "!raw",
-                    "identifier",
-                    raw_data.get("statementType", "none"),
-                    f"{schemeName}|{scheme}|{senzing_attr}",
-                    value=id_value,
+                number_attr, type_attrs, stat_key = self.get_identifier_conversion(
+                    scheme, schemeName
                 )
-                if senzing_attr == "NATIONAL_ID":
-                    mapped_data = {
-                        "NATIONAL_ID_NUMBER": id_value,
-                        "NATIONAL_ID_TYPE": scheme,
-                        "NATIONAL_ID_COUNTRY": country,
-                    }
-                elif senzing_attr == "OTHER_ID":
-                    mapped_data = {
-                        "OTHER_ID_NUMBER": id_value,
-                        "OTHER_ID_TYPE": scheme if scheme else schemeName,
-                        "OTHER_ID_COUNTRY": country,
-                    }
-                else:
-                    mapped_data = {senzing_attr: id_value}
+                if self.raw_stats:
+                    self.update_stat(
+                        "!raw",
+                        "identifier",
+                        raw_data.get("statementType", "none"),
+                        stat_key,
+                        value=id_value,
+                    )
+                if not self.keep_value(id_value):
+                    continue
+                mapped_data = {number_attr: id_value}
+                mapped_data.update(type_attrs)
                 identifiers.append(mapped_data)
         return identifiers, links
 
+    def get_identifier_conversion(self, scheme, scheme_name):
+        conversion = self.identifier_cache.get((scheme, scheme_name))
+        if conversion is None:
+            senzing_attr, country = self.conversions["ID_TYPE"].get(
+                scheme, self.conversions["DEFAULT_ID_TYPE"]
+            )
+            # the type and country attributes are the same for every identifier
+            # of the scheme, so empty ones are left out here once
+            if senzing_attr in ("NATIONAL_ID", "OTHER_ID"):
+                number_attr = f"{senzing_attr}_NUMBER"
+                id_type = (
+                    scheme if scheme or senzing_attr == "NATIONAL_ID" else scheme_name
+                )
+                type_attrs = tuple(
+                    (x, y)
+                    for x, y in (
+                        (f"{senzing_attr}_TYPE", id_type),
+                        (f"{senzing_attr}_COUNTRY", country),
+                    )
+                    if self.keep_value(y)
+                )
+            else:
+                number_attr = senzing_attr
+                type_attrs = ()
+            conversion = (
+                number_attr,
+                type_attrs,
+                f"{scheme_name}|{scheme}|{senzing_attr}",
+            )
+            self.identifier_cache[(scheme, scheme_name)] = conversion
+        return conversion
+
+    def keep_value(self, value):
+        return not self.prune_empty or has_value(value)
+
+    def get_role(self, interest_type):
+        role = self.role_cache.get(interest_type)
+        if role is None:
+            role = self.conversions["ROLE_NAMES"].get(interest_type)
+            if role is None:
+                role = interest_type
+                for old_text, new_text in self.conversions["ROLE_REPLACE"]:
+                    role = role.replace(old_text, new_text)
+            role = sys.intern(role)
+            self.role_cache[interest_type] = role
+        return role
+
+    def consolidate_relationships(self, json_data):
+        # drops pointers stated more than once and, optionally, the ones from
+        # ownership statements replaced by a later statement about the subject
+        replaced = json_data.pop("replaced_ownership_statements", None)
+        relationship_list = json_data.get("RELATIONSHIPS")
+        if not relationship_list:
+            return json_data
+        if not (replaced and self.collapse_replaced):
+            # a single relationship cannot be a duplicate, whether or not the
+            # fragment has its anchor yet
+            if not self.dedup_relationships or len(relationship_list) < 2:
+                return json_data
+            replaced = None
+        else:
+            replaced = set(replaced)
+
+        pointer_keys = set()
+        consolidated_list = []
+        for relationship in relationship_list:
+            if not isinstance(relationship, dict):
+                relationship = rel_pointer(*relationship)
+                if replaced and relationship.statement_id in replaced:
+                    self.update_stat(
+                        "!relationships",
+                        "replaced-removed",
+                        value=relationship.statement_id,
+                    )
+                    continue
+                if self.dedup_relationships:
+                    pointer_key = relationship[:4]
+                    if pointer_key in pointer_keys:
+                        self.update_stat(
+                            "!relationships",
+                            "duplicate-removed",
+                            value=json_data["RECORD_ID"],
+                        )
+                        continue
+                    pointer_keys.add(pointer_key)
+            consolidated_list.append(relationship)
+        json_data["RELATIONSHIPS"] = consolidated_list
+        return json_data
+
     def remove_empty_tags(self, d):
         if isinstance(d, dict):
             for k, v in list(d.items()):
@@ -292,82 +595,80 @@ class mapper:
                 self.remove_empty_tags(v)
         return d
 
-    def update_stat(self, *args, **kwargs):
-
-        if len(args) > 0 and args[0] not in self.stat_pack:
-            self.stat_pack[args[0]] = {}
-        if len(args) > 1 and args[1] not in self.stat_pack[args[0]]:
-            self.stat_pack[args[0]][args[1]] = {}
-        if len(args) > 2 and args[2] not in self.stat_pack[args[0]][args[1]]:
-            self.stat_pack[args[0]][args[1]][args[2]] = {}
-        if len(args) > 3 and args[3] not in self.stat_pack[args[0]][args[1]][args[2]]:
-            self.stat_pack[args[0]][args[1]][args[2]][args[3]] = {}
-
-        if len(args) == 1:
-            if "count" not in self.stat_pack[args[0]]:
-                self.stat_pack[args[0]]["count"] = 1
-            else:
-                self.stat_pack[args[0]]["count"] += 1
-        elif len(args) == 2:
-            if "count" not in self.stat_pack[args[0]][args[1]]:
-                self.stat_pack[args[0]][args[1]]["count"] = 1
-            else:
-                self.stat_pack[args[0]][args[1]]["count"] += 1
-        elif len(args) == 3:
-            if "count" not in self.stat_pack[args[0]][args[1]][args[2]]:
-                self.stat_pack[args[0]][args[1]][args[2]]["count"] = 1
-            else:
-                self.stat_pack[args[0]][args[1]][args[2]]["count"] += 1
-        elif len(args) == 4:
-            if "count" not in self.stat_pack[args[0]][args[1]][args[2]][args[3]]:
-                self.stat_pack[args[0]][args[1]][args[2]][args[3]]["count"] = 1
-            else:
-                self.stat_pack[args[0]][args[1]][args[2]][args[3]]["count"] += 1
+    def reset_stats(self):
+        # flat counters keyed by the stat path, rendered into the nested
+        # stat_pack shape only when it is written
+        self.stat_counts = {}
+        self.stat_samples = {}
 
+    def update_stat(self, *args, **kwargs):
+        if self.stats_level == "none":
+            return
+        self.stat_counts[args] = self.stat_counts.get(args, 0) + 1
         if "value" in kwargs:
-            value = kwargs["value"]
-            if len(args) == 1:
-                if "value" not in self.stat_pack[args[0]]:
-                    self.stat_pack[args[0]]["value"] = [value]
-                elif (
-                    len(self.stat_pack[args[0]]["value"]) < 10
-                    and value not in self.stat_pack[args[0]]["value"]
-                ):
-                    self.stat_pack[args[0]]["value"].append(value)
-            elif len(args) == 2:
-                if "value" not in self.stat_pack[args[0]][args[1]]:
-                    self.stat_pack[args[0]][args[1]]["value"] = [value]
-                elif (
-                    len(self.stat_pack[args[0]][args[1]]["value"]) < 10
-                    and value not in self.stat_pack[args[0]][args[1]]["value"]
-                ):
-                    self.stat_pack[args[0]][args[1]]["value"].append(value)
-            elif len(args) == 3:
-                if "value" not in self.stat_pack[args[0]][args[1]][args[2]]:
-                    self.stat_pack[args[0]][args[1]][args[2]]["value"] = [value]
-                elif (
-                    len(self.stat_pack[args[0]][args[1]][args[2]]["value"]) < 10
-                    and value not in self.stat_pack[args[0]][args[1]][args[2]]["value"]
-                ):
-                    self.stat_pack[args[0]][args[1]][args[2]]["value"].append(value)
-            elif len(args) == 4:
-                if "value" not in self.stat_pack[args[0]][args[1]][args[2]][args[3]]:
-                    self.stat_pack[args[0]][args[1]][args[2]][args[3]]["value"] = [
-                        value
-                    ]
-                elif (
-                    len(self.stat_pack[args[0]][args[1]][args[2]][args[3]]["value"])
-                    < 10
-                    and value
-                    not in self.stat_pack[args[0]][args[1]][args[2]][args[3]]["value"]
-                ):
-                    self.stat_pack[args[0]][args[1]][args[2]][args[3]]["value"].append(
-                        value
-                    )
+            samples = self.stat_samples.get(args)
+            if samples is None:
+                self.stat_samples[args] = [kwargs["value"]]
+            elif len(samples) < 10 and kwargs["value"] not in samples:
+                samples.append(kwargs["value"])
+
+    def merge_stats(self, stat_counts, stat_samples):
+        # merging in input order gives the same counts and sample values as a serial run
+        for stat_path, count in stat_counts.items():
+            self.stat_counts[stat_path] = self.stat_counts.get(stat_path, 0) + count
+        for stat_path, samples in stat_samples.items():
+            target = self.stat_samples.get(stat_path)
+            if target is None:
+                self.stat_samples[stat_path] = list(samples)
+            else:
+                for sample in samples:
+                    if len(target) >= 10:
+                        break
+                    if sample not in target:
+                        target.append(sample)
+
+    def save_stats(self):
+        return {
+            "counts": [[list(x), y] for x, y in self.stat_counts.items()],
+            "samples": [[list(x), y] for x, y in self.stat_samples.items()],
+        }
+
+    def restore_stats(self, stats_state):
+        self.reset_stats()
+        self.stat_counts.update((tuple(x), y) for x, y in stats_state["counts"])
+        self.stat_samples.update((tuple(x), y) for x, y in stats_state["samples"])
+
+    def merge_stat_pack(self, stat_pack, stat_path=()):
+        # adds a stat_pack written by another run, for instance another partition
+        stat_counts = {}
+        stat_samples = {}
+        for key, stat_node in stat_pack.items():
+            if key == "count" and isinstance(stat_node, int):
+                stat_counts[stat_path] = stat_node
+            elif key == "value" and isinstance(stat_node, list):
+                stat_samples[stat_path] = stat_node
+            elif isinstance(stat_node, dict):
+                self.merge_stat_pack(stat_node, stat_path + (key,))
+        self.merge_stats(stat_counts, stat_samples)
+
+    @property
+    def stat_pack(self):
+        stat_pack = {}
+        for stat_path, count in self.stat_counts.items():
+            stat_node = stat_pack
+            for key in stat_path:
+                stat_node = stat_node.setdefault(key, {})
+            stat_node["count"] = count
+            if stat_path in self.stat_samples:
+                stat_node["value"] = self.stat_samples[stat_path]
+        return stat_pack
 
     def capture_mapped_stats(self, json_data):
 
         record_type = json_data.get("RECORD_TYPE", "UNKNOWN_TYPE")
+        if not self.raw_stats:
+            self.update_stat(record_type)
+            return
 
         for key1 in json_data:
             if not isinstance(json_data[key1], list):
@@ -378,6 +679,1718 @@ class mapper:
                         self.update_stat(record_type, key2, value=subrecord[key2])
 
 
+def format_float(value):
+    # how orjson writes a float: no + or leading zero in the exponent, no
+    # exponent from 1e-5 to 1e-4, and null for nan and infinity
+    if math.isnan(value) or math.isinf(value):
+        return "null"
+    mantissa, _, exponent = repr(value).partition("e")
+    if not exponent:
+        return mantissa
+    if int(exponent) == -5:
+        sign = "-" if mantissa.startswith("-") else ""
+        return sign + "0.0000" + mantissa.lstrip("-").replace(".", "")
+    return f"{mantissa}e{int(exponent)}"
+
+
+def encode_floats(json_data):
+    # the slow path of the stdlib backend, only taken for records with floats
+    if isinstance(json_data, float):
+        return format_float(json_data)
+    if isinstance(json_data, dict):
+        return (
+            "{"
+            + ",".join(
+                json.dumps(str(x), ensure_ascii=False) + ":" + encode_floats(y)
+                for x, y in json_data.items()
+            )
+            + "}"
+        )
+    if isinstance(json_data, (list, tuple)):
+        return "[" + ",".join(encode_floats(x) for x in json_data) + "]"
+    return json.dumps(json_data, ensure_ascii=False)
+
+
+def parse_int(text):
+    # orjson reads integers outside 64 bits as floats
+    value = int(text)
+    if -(2**63) <= value < 2**64:
+        return value
+    return float(value)
+
+
+def parse_float(text):
+    value = float(text)
+    if math.isinf(value):
+        raise ValueError(f"number is infinity: {text}")
+    return value
+
+
+def parse_constant(text):
+    raise ValueError(f"{text} is not valid json")
+
+
+# =========================
+class json_codec:
+
+    # both backends write compact utf-8 so output is byte for byte the same. The
+    # stdlib backend reads and writes numbers and surrogates the way orjson does
+    surrogate_pattern = re.compile(r"\\u[dD][89a-fA-F]|[\ud800-\udfff]")
+    python_float_pattern = re.compile(rb"\de[+-]|NaN|Infinity")
+
+    def __init__(self, backend="auto"):
+        if backend == "auto":
+            backend = "orjson" if orjson else "stdlib"
+        if backend == "orjson" and not orjson:
+            raise ValueError("the orjson package is not installed")
+        self.backend = backend
+        if backend == "orjson":
+            self.loads = orjson.loads
+            self.encode = orjson.dumps
+        else:
+            self.decoder = json.JSONDecoder(
+                parse_float=parse_float,
+                parse_int=parse_int,
+                parse_constant=parse_constant,
+            )
+            self.loads = self.stdlib_loads
+            self.encode = self.stdlib_encode
+
+    def encode_fragment(self, json_data):
+        # fragments can still hold rel_pointer tuples, orjson only writes
+        # subclasses of tuple through default
+        if self.backend == "orjson":
+            return orjson.dumps(json_data, default=tuple)
+        return self.stdlib_encode(json_data)
+
+    def stdlib_loads(self, line):
+        if isinstance(line, bytes):
+            line = line.decode("utf-8")
+        json_data = self.decoder.decode(line)
+        if self.surrogate_pattern.search(line):
+            # a lone surrogate cannot be written as utf-8, so the line is
+            # rejected here like orjson does instead of failing on write
+            try:
+                self.stdlib_encode(json_data)
+            except UnicodeEncodeError as err:
+                raise ValueError(f"surrogates not allowed: {err.reason}") from err
+        return json_data
+
+    def stdlib_encode(self, json_data):
+        line = json.dumps(json_data, ensure_ascii=False, separators=(",", ":")).encode(
+            "utf-8"
+        )
+        if self.python_float_pattern.search(line):
+            line = encode_floats(json_data).encode("utf-8")
+        return line
+
+    def decode(self, line):
+        try:
+            return self.loads(line)
+        except ValueError:
+            if not isinstance(line, bytes):
+                raise
+            # invalid utf-8 is dropped rather than failing the row
+            return self.loads(line.decode("utf-8", errors="ignore"))
+
+
+# =========================
+class rel_pointer(
+    collections.namedtuple("rel_pointer", "key role from_date thru_date statement_id")
+):
+
+    # relationships are held in this compact form, with the keys and roles
+    # interned, until the record is written. A tuple takes a third of the
+    # memory of the equivalent dict. The statement_id is not written, it is
+    # only kept, with --collapse_replaced, to collapse replaced ownership
+    # statements and is None otherwise
+    __slots__ = ()
+
+    def to_dict(self):
+        relationship = {
+            "REL_POINTER_DOMAIN": "OOR",
+            "REL_POINTER_KEY": self.key,
+            "REL_POINTER_ROLE": self.role,
+        }
+        if self.from_date:
+            relationship["REL_POINTER_FROM_DATE"] = self.from_date
+        if self.thru_date:
+            relationship["REL_POINTER_THRU_DATE"] = self.thru_date
+        return relationship
+
+
+def expand_relationships(json_data):
+    # turns rel_pointer tuples, or the lists they are stored as in the sqlite
+    # merge store, into senzing relationship attributes
+    if json_data.get("RELATIONSHIPS"):
+        json_data["RELATIONSHIPS"] = [
+            x if isinstance(x, dict) else rel_pointer(*x).to_dict()
+            for x in json_data["RELATIONSHIPS"]
+        ]
+    return json_data
+
+
+def finish_record(record_mapper, json_data):
+    # the last steps before a merged record is written, returns None for a
+    # subject that only ever had relationships
+    if not json_data.get("RECORD_TYPE"):
+        record_mapper.update_stat(
+            "!alert",
+            "relationship-without-entity!",
+            value=json_data.get("RECORD_ID"),
+        )
+        return None
+    record_mapper.consolidate_relationships(json_data)
+    expand_relationships(json_data)
+    record_mapper.capture_mapped_stats(json_data)
+    return json_data
+
+
+def merge_record(cached_data, json_data):
+    for attr in json_data.keys():
+        if attr == "RELATIONSHIPS":
+            cached_data["RELATIONSHIPS"].extend(json_data["RELATIONSHIPS"])
+        elif attr == "replaced_ownership_statements" and attr in cached_data:
+            cached_data[attr].extend(json_data[attr])
+        elif attr not in cached_data:
+            cached_data[attr] = json_data[attr]
+    return cached_data
+
+
+# =========================
+class memory_merge_store:
+
+    def __init__(self):
+        self.records = {}
+
+    def __len__(self):
+        return len(self.records)
+
+    def add(self, json_data):
+        record_id = json_data["RECORD_ID"]
+        if record_id not in self.records:
+            self.records[record_id] = json_data
+        else:
+            merge_record(self.records[record_id], json_data)
+
+    def get_records(self):
+        yield from self.records.values()
+
+    def save_state(self, checkpoint_file, input_row_count):
+        records_file = f"{checkpoint_file}.{input_row_count}.pickle"
+        with open(records_file, "wb") as outfile:
+            pickle.dump(self.records, outfile, protocol=pickle.HIGHEST_PROTOCOL)
+        return {"records_file": records_file}
+
+    def restore_state(self, state):
+        with open(state["records_file"], "rb") as infile:
+            self.records = pickle.load(infile)
+
+    def remove_state(self, state):
+        if os.path.exists(state["records_file"]):
+            os.remove(state["records_file"])
+
+    def close(self, remove_file=None):
+        self.records = {}
+
+
+# =========================
+class sqlite_merge_store:  # pylint: disable=too-many-instance-attributes
+
+    # fragments are appended as they are mapped and only merged on the way out,
+    # so memory is bounded by the insert batch plus the sqlite page cache
+    def __init__(  # pylint: disable=too-many-arguments,too-many-positional-arguments
+        self,
+        db_path=None,
+        cache_mb=256,
+        batch_size=10000,
+        temp_dir=None,
+        codec=None,
+        resume=False,
+        durable=False,
+    ):
+        self.codec = codec if codec else json_codec()
+        self.durable = durable
+        self.temp_file = not db_path
+        if self.temp_file:
+            db_handle, db_path = tempfile.mkstemp(
+                prefix="oor_merge_", suffix=".db", dir=temp_dir
+            )
+            os.close(db_handle)
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self.pending = []
+        self.record_count = 0
+
+        self.conn = sqlite3.connect(self.db_path)
+        if durable:
+            # a database kept for --resume has to survive a crash mid transaction,
+            # which would very likely corrupt it without a journal
+            self.conn.execute("PRAGMA journal_mode = WAL")
+            self.conn.execute("PRAGMA synchronous = NORMAL")
+        else:
+            self.conn.execute("PRAGMA journal_mode = OFF")
+            self.conn.execute("PRAGMA synchronous = OFF")
+        self.conn.execute("PRAGMA temp_store = FILE")
+        self.conn.execute(f"PRAGMA cache_size = {-1024 * cache_mb}")
+        if not resume:
+            self.conn.execute("DROP TABLE IF EXISTS record_keys")
+            self.conn.execute("DROP TABLE IF EXISTS fragments")
+            # record_keys rowid preserves the order record_ids were first seen
+            self.conn.execute("CREATE TABLE record_keys (record_id TEXT PRIMARY KEY)")
+            self.conn.execute("CREATE TABLE fragments (record_id TEXT, data BLOB)")
+            self.conn.commit()
+
+    def __len__(self):
+        self.flush()
+        return self.record_count
+
+    def add(self, json_data):
+        self.pending.append(
+            (json_data["RECORD_ID"], self.codec.encode_fragment(json_data))
+        )
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if self.pending:
+            cursor = self.conn.executemany(
+                "INSERT OR IGNORE INTO record_keys (record_id) VALUES (?)",
+                [(x[0],) for x in self.pending],
+            )
+            self.record_count += cursor.rowcount
+            self.conn.executemany(
+                "INSERT INTO fragments (record_id, data) VALUES (?, ?)", self.pending
+            )
+            self.conn.commit()
+            self.pending = []
+
+    def get_records(self):
+        self.flush()
+        self.conn.execute(
+            "CREATE INDEX IF NOT EXISTS fragments_ix ON fragments (record_id)"
+        )
+        cursor = self.conn.execute(
+            "SELECT f.record_id, f.data FROM record_keys k "
+            "JOIN fragments f ON f.record_id = k.record_id "
+            "ORDER BY k.rowid, f.rowid"
+        )
+        current_id = None
+        cached_data = None
+        for record_id, data in cursor:
+            if record_id != current_id:
+                if cached_data:
+                    yield cached_data
+                current_id = record_id
+                cached_data = self.codec.loads(data)
+            else:
+                merge_record(cached_data, self.codec.loads(data))
+        if cached_data:
+            yield cached_data
+
+    def save_state(self, checkpoint_file, input_row_count):
+        # rows are only ever appended, so the rowid high water marks are enough
+        # to roll the database back to this checkpoint
+        self.flush()
+        if self.durable:
+            # syncs the rows up to the checkpoint to the database file
+            self.conn.execute("PRAGMA wal_checkpoint(FULL)")
+        return {
+            "db_path": self.db_path,
+            "key_rowid": self.conn.execute(
+                "SELECT coalesce(max(rowid), 0) FROM record_keys"
+            ).fetchone()[0],
+            "fragment_rowid": self.conn.execute(
+                "SELECT coalesce(max(rowid), 0) FROM fragments"
+            ).fetchone()[0],
+        }
+
+    def restore_state(self, state):
+        self.conn.execute(
+            "DELETE FROM record_keys WHERE rowid > ?", (state["key_rowid"],)
+        )
+        self.conn.execute(
+            "DELETE FROM fragments WHERE rowid > ?", (state["fragment_rowid"],)
+        )
+        self.conn.commit()
+        self.record_count = self.conn.execute(
+            "SELECT count(*) FROM record_keys"
+        ).fetchone()[0]
+
+    def remove_state(self, state):
+        pass
+
+    def close(self, remove_file=None):
+        self.conn.close()
+        if remove_file is None:
+            remove_file = self.temp_file
+        if remove_file and os.path.exists(self.db_path):
+            os.remove(self.db_path)
+
+
+# =========================
+class relationship_index:
+
+    # pass one of the streaming mode only keeps each relationship's row number
+    # and rel_pointer, keyed by the subject statementID
+    def __init__(self):
+        self.subjects = {}
+        self.replaced = {}
+
+    def __len__(self):
+        return len(self.subjects)
+
+    def add(self, input_row_num, json_data):
+        rel_list = self.subjects.setdefault(json_data["RECORD_ID"], [])
+        for relationship in json_data["RELATIONSHIPS"]:
+            rel_list.append((input_row_num, relationship))
+        if json_data.get("replaced_ownership_statements"):
+            self.replaced.setdefault(json_data["RECORD_ID"], []).extend(
+                json_data["replaced_ownership_statements"]
+            )
+
+    def merge(self, input_row_num, json_data):
+        # replays the merge in input order so the record matches the merge store's
+        rel_list = self.subjects.pop(json_data["RECORD_ID"], None)
+        if not rel_list:
+            return json_data
+        replaced = self.replaced.pop(json_data["RECORD_ID"], None)
+        if replaced:
+            json_data["replaced_ownership_statements"] = replaced
+        earlier = [x[1] for x in rel_list if x[0] < input_row_num]
+        later = [x[1] for x in rel_list if x[0] > input_row_num]
+        if earlier:
+            cached_data = {
+                "DATA_SOURCE": json_data["DATA_SOURCE"],
+                "RECORD_ID": json_data["RECORD_ID"],
+                "RELATIONSHIPS": earlier,
+            }
+            merge_record(cached_data, json_data)
+        else:
+            cached_data = json_data
+        cached_data["RELATIONSHIPS"].extend(later)
+        return cached_data
+
+    def get_orphans(self):
+        yield from self.subjects.keys()
+
+
+# =========================
+class output_writer:
+
+    def __init__(self, file_name, codec=None):
+        self.file_name = file_name
+        self.codec = codec if codec else json_codec()
+        if file_name.endswith(".gz"):
+            self.file_handle = gzip.open(file_name, "wb")
+        else:
+            self.file_handle = open(file_name, "wb")
+        self.row_count = 0
+
+    def write(self, json_data, line=None):
+        if line is None:
+            line = self.codec.encode(json_data)
+        self.file_handle.write(line + b"\n")
+        self.row_count += 1
+        return line
+
+    def close(self):
+        self.file_handle.close()
+
+
+# =========================
+class quarantine_writer:
+
+    # rows that could not be mapped, with their line number and the reason. The
+    # file is only created once there is a row to write
+    def __init__(self, file_name=None, error_count=0, resume_size=None):
+        self.file_name = file_name
+        self.error_count = error_count
+        self.file_handle = None
+        if file_name and resume_size is not None and os.path.exists(file_name):
+            # rows after the checkpoint are read again, so their errors are too
+            self.file_handle = open(file_name, "r+b")
+            self.file_handle.truncate(resume_size)
+            self.file_handle.seek(resume_size)
+
+    def write(self, error_list):
+        self.error_count += len(error_list)
+        if not self.file_name:
+            return
+        if not self.file_handle:
+            self.file_handle = open(self.file_name, "wb")
+        for input_row_num, reason, message, line in error_list:
+            if isinstance(line, bytes):
+                line = line.decode("utf-8", errors="replace").rstrip("\r\n")
+            error_data = {
+                "line_number": input_row_num,
+                "reason": reason,
+                "error": message,
+                "line": line,
+            }
+            self.file_handle.write(
+                json.dumps(error_data, ensure_ascii=False).encode("utf-8") + b"\n"
+            )
+
+    def tell(self):
+        if not self.file_handle:
+            return 0
+        self.file_handle.flush()
+        return self.file_handle.tell()
+
+    def close(self):
+        if self.file_handle:
+            self.file_handle.close()
+
+
+def record_hash(record_id):
+    # crc32 is stable across runs and platforms, unlike hash()
+    return zlib.crc32(record_id.encode("utf-8"))
+
+
+def in_partition(record_id, partition):
+    # the high bits of the hash pick the partition and the low bits the shard,
+    # so sharding a partition's output still spreads it evenly
+    partition_num, partition_count = partition
+    return (record_hash(record_id) >> 16) % partition_count == partition_num
+
+
+def split_output_name(file_name):
+    base_file_name, file_extension = os.path.splitext(file_name)
+    if file_extension.upper() == ".GZ":
+        base_file_name, inner_extension = os.path.splitext(base_file_name)
+        file_extension = inner_extension + file_extension
+    return base_file_name, file_extension
+
+
+# =========================
+class checksum_file:
+
+    def __init__(self, file_name):
+        self.file_handle = open(file_name, "wb")
+        self.checksum = hashlib.sha256()
+        self.byte_count = 0
+
+    def write(self, data):
+        self.checksum.update(data)
+        self.byte_count += len(data)
+        return self.file_handle.write(data)
+
+    def flush(self):
+        self.file_handle.flush()
+
+    def close(self):
+        self.file_handle.close()
+
+
+# =========================
+class shard_file:
+
+    # the open output file of a shard part and its manifest entry
+    def __init__(self, file_name, shard_num, part_num, compressed):
+        self.entry = {
+            "file_name": file_name,
+            "shard": shard_num,
+            "part": part_num,
+            "record_count": 0,
+        }
+        self.raw_file = checksum_file(file_name)
+        if compressed:
+            self.file_handle = gzip.GzipFile(fileobj=self.raw_file, mode="wb")
+        else:
+            self.file_handle = self.raw_file
+
+    def write(self, data, line_count):
+        self.file_handle.write(data)
+        self.entry["record_count"] += line_count
+
+    def close(self):
+        if self.file_handle is not self.raw_file:
+            self.file_handle.close()
+        self.raw_file.close()
+        self.entry["byte_count"] = self.raw_file.byte_count
+        self.entry["sha256"] = self.raw_file.checksum.hexdigest()
+
+
+# =========================
+class sharded_output_writer:  # pylint: disable=too-many-instance-attributes
+
+    # records are partitioned by a hash of their RECORD_ID and each shard is
+    # compressed and written by its own thread in batches of lines
+    def __init__(  # pylint: disable=too-many-arguments,too-many-positional-arguments
+        self,
+        file_name,
+        shards=1,
+        max_records_per_file=0,
+        codec=None,
+        batch_size=1000,
+    ):
+        self.codec = codec if codec else json_codec()
+        self.shards = shards
+        self.max_records_per_file = max_records_per_file
+        self.batch_size = batch_size
+        self.base_file_name, self.file_extension = split_output_name(file_name)
+        self.compressed = file_name.endswith(".gz")
+        self.manifest_file_name = self.base_file_name + "_manifest.json"
+        self.row_count = 0
+
+        self.buffers = [[] for x in range(shards)]
+        self.part_nums = [1] * shards
+        self.part_counts = [0] * shards
+        self.errors = [None] * shards
+        self.file_list = []
+        self.queues = [queue.Queue(maxsize=4) for x in range(shards)]
+        self.threads = [
+            threading.Thread(target=self.shard_writer, args=(x,), daemon=True)
+            for x in range(shards)
+        ]
+        for thread in self.threads:
+            thread.start()
+
+    def get_file_name(self, shard_num, part_num):
+        file_name = self.base_file_name
+        if self.shards > 1:
+            file_name += f"_{shard_num:03d}"
+        if self.max_records_per_file:
+            file_name += f"_{part_num:03d}"
+        return file_name + self.file_extension
+
+    def write(self, json_data, line=None):
+        if line is None:
+            line = self.codec.encode(json_data)
+        shard_num = record_hash(json_data["RECORD_ID"]) % self.shards
+        self.buffers[shard_num].append(line)
+        self.part_counts[shard_num] += 1
+        self.row_count += 1
+        if (
+            self.max_records_per_file
+            and self.part_counts[shard_num] >= self.max_records_per_file
+        ):
+            self.flush_shard(shard_num)
+            self.part_nums[shard_num] += 1
+            self.part_counts[shard_num] = 0
+        elif len(self.buffers[shard_num]) >= self.batch_size:
+            self.flush_shard(shard_num)
+        return line
+
+    def flush_shard(self, shard_num):
+        if self.errors[shard_num]:
+            raise self.errors[shard_num]
+        buffer = self.buffers[shard_num]
+        if buffer:
+            line_count = len(buffer)
+            buffer.append(b"")
+            self.queues[shard_num].put(
+                (self.part_nums[shard_num], b"\n".join(buffer), line_count)
+            )
+            self.buffers[shard_num] = []
+
+    def shard_writer(self, shard_num):
+        current_file = None
+        while True:
+            item = self.queues[shard_num].get()
+            if item is None:
+                break
+            if self.errors[shard_num]:
+                continue  # keep draining so the main thread never blocks
+            part_num, data, line_count = item
+            try:
+                if current_file is None or current_file.entry["part"] != part_num:
+                    if current_file is not None:
+                        current_file.close()
+                    current_file = shard_file(
+                        self.get_file_name(shard_num, part_num),
+                        shard_num,
+                        part_num,
+                        self.compressed,
+                    )
+                    self.file_list.append(current_file.entry)
+                current_file.write(data, line_count)
+            except OSError as err:
+                self.errors[shard_num] = err
+        try:
+            if current_file is not None:
+                current_file.close()
+        except OSError as err:
+            self.errors[shard_num] = err
+
+    def close(self):
+        for shard_num in range(self.shards):
+            if not self.errors[shard_num]:
+                self.flush_shard(shard_num)
+            self.queues[shard_num].put(None)
+        for thread in self.threads:
+            thread.join()
+        if any(self.errors):
+            raise next(x for x in self.errors if x)
+
+        manifest = {
+            "record_count": self.row_count,
+            "shards": self.shards,
+            "max_records_per_file": self.max_records_per_file,
+            "files": sorted(self.file_list, key=lambda x: (x["shard"], x["part"])),
+        }
+        with open(self.manifest_file_name, "w") as outfile:
+            json.dump(manifest, outfile, indent=4)
+        print(
+            f"{len(self.file_list):,} output files listed in {self.manifest_file_name}"
+        )
+
+
+# =========================
+class columnar_writer:  # pylint: disable=too-many-instance-attributes
+
+    # the finished records split into flat tables keyed by RECORD_ID, written
+    # a batch at a time as parquet when pyarrow is installed or else as gzipped
+    # csv. Every value is kept as a string
+    tables = {
+        "records": (
+            "RECORD_ID",
+            "DATA_SOURCE",
+            "RECORD_TYPE",
+            "STATEMENT_DATE",
+            "REGISTRATION_DATE",
+            "REGISTRATION_COUNTRY",
+            "DATE_OF_BIRTH",
+            "dissolutionDate",
+            "personType",
+        ),
+        "names": ("RECORD_ID", "NAME_TYPE", "NAME_ORG", "NAME_FULL"),
+        "addresses": ("RECORD_ID", "ADDR_TYPE", "ADDR_FULL", "ADDR_COUNTRY"),
+        "identifiers": ("RECORD_ID", "ID_ATTR", "ID_NUMBER", "ID_TYPE", "ID_COUNTRY"),
+        "relationships": (
+            "RECORD_ID",
+            "REL_POINTER_KEY",
+            "REL_POINTER_ROLE",
+            "REL_POINTER_FROM_DATE",
+            "REL_POINTER_THRU_DATE",
+        ),
+        "attributes": ("RECORD_ID", "ATTR_GROUP", "ATTR_NAME", "ATTR_VALUE"),
+    }
+
+    def __init__(self, directory, file_format=None, batch_size=50000):
+        if not file_format:
+            file_format = "parquet" if pyarrow else "csv"
+        if file_format == "parquet" and not pyarrow:
+            raise ValueError("the parquet format needs pyarrow to be installed")
+        self.directory = directory
+        self.file_format = file_format
+        self.batch_size = batch_size
+        self.row_count = 0
+        self.table_row_counts = {x: 0 for x in self.tables}
+        os.makedirs(directory, exist_ok=True)
+
+        self.columns = {}
+        self.writers = {}
+        self.file_handles = {}
+        for table_name, column_names in self.tables.items():
+            self.columns[table_name] = {x: [] for x in column_names}
+            file_name = os.path.join(directory, table_name)
+            if file_format == "parquet":
+                schema = pyarrow.schema([(x, pyarrow.string()) for x in column_names])
+                self.writers[table_name] = pyarrow.parquet.ParquetWriter(
+                    file_name + ".parquet", schema, compression="zstd"
+                )
+            else:
+                file_handle = gzip.open(
+                    file_name + ".csv.gz",
+                    "wt",
+                    compresslevel=6,
+                    encoding="utf-8",
+                    newline="",
+                )
+                self.file_handles[table_name] = file_handle
+                self.writers[table_name] = csv.writer(file_handle)
+                self.writers[table_name].writerow(column_names)
+
+    def write(self, json_data, line=None):
+        record_id = json_data["RECORD_ID"]
+        record_columns = self.tables["records"]
+        record_row = {}
+        for attr, value in json_data.items():
+            if attr in record_columns:
+                record_row[attr] = value
+            elif attr == "PRIMARY_NAME_FULL":
+                self.add_row("names", record_id, ("PRIMARY", None, value))
+            elif attr == "NAMES":
+                for name_data in value:
+                    for name_attr, name_value in name_data.items():
+                        name_type, _, name_part = name_attr.rpartition("_NAME_")
+                        if name_part == "ORG":
+                            self.add_row(
+                                "names", record_id, (name_type, name_value, None)
+                            )
+                        else:
+                            self.add_row(
+                                "names",
+                                record_id,
+                                (name_type or name_attr, None, name_value),
+                            )
+            elif attr == "ADDRESSES":
+                for addr_data in value:
+                    self.add_row(
+                        "addresses",
+                        record_id,
+                        (
+                            addr_data.get("ADDR_TYPE"),
+                            addr_data.get("ADDR_FULL"),
+                            addr_data.get("ADDR_COUNTRY"),
+                        ),
+                    )
+            elif attr == "IDENTIFIERS":
+                for id_data in value:
+                    id_attr = id_number = id_type = id_country = None
+                    for key, id_value in id_data.items():
+                        if key.endswith("_TYPE"):
+                            id_type = id_value
+                        elif key.endswith("_COUNTRY"):
+                            id_country = id_value
+                        else:
+                            id_attr = key.removesuffix("_NUMBER")
+                            id_number = id_value
+                    self.add_row(
+                        "identifiers",
+                        record_id,
+                        (id_attr, id_number, id_type, id_country),
+                    )
+            elif attr == "RELATIONSHIPS":
+                for rel_data in value:
+                    if "REL_POINTER_KEY" in rel_data:
+                        self.add_row(
+                            "relationships",
+                            record_id,
+                            (
+                                rel_data["REL_POINTER_KEY"],
+                                rel_data.get("REL_POINTER_ROLE"),
+                                rel_data.get("REL_POINTER_FROM_DATE"),
+                                rel_data.get("REL_POINTER_THRU_DATE"),
+                            ),
+                        )
+            elif isinstance(value, list):
+                # ATTRIBUTES, LINKS and replaces_statements, named in ATTR_GROUP
+                for item_data in value:
+                    for item_attr, item_value in item_data.items():
+                        self.add_row(
+                            "attributes", record_id, (attr, item_attr, item_value)
+                        )
+            else:
+                self.add_row("attributes", record_id, (None, attr, value))
+        self.add_row(
+            "records", record_id, [record_row.get(x) for x in record_columns[1:]]
+        )
+        self.row_count += 1
+        if self.row_count % self.batch_size == 0:
+            self.flush()
+
+    def add_row(self, table_name, record_id, values):
+        table_columns = self.columns[table_name]
+        table_columns["RECORD_ID"].append(record_id)
+        for column_name, value in zip(self.tables[table_name][1:], values):
+            if value is not None and not isinstance(value, str):
+                value = str(value)
+            table_columns[column_name].append(value)
+
+    def flush(self):
+        for table_name, table_columns in self.columns.items():
+            row_count = len(table_columns["RECORD_ID"])
+            if not row_count:
+                continue
+            if self.file_format == "parquet":
+                self.writers[table_name].write_table(
+                    pyarrow.Table.from_pydict(
+                        table_columns, schema=self.writers[table_name].schema
+                    )
+                )
+            else:
+                self.writers[table_name].writerows(zip(*table_columns.values()))
+            self.table_row_counts[table_name] += row_count
+            self.columns[table_name] = {x: [] for x in table_columns}
+
+    def close(self):
+        self.flush()
+        for table_name in self.tables:
+            if self.file_format == "parquet":
+                self.writers[table_name].close()
+            else:
+                self.file_handles[table_name].close()
+        print(
+            f"{self.row_count:,} records exported to {self.file_format} tables in {self.directory}"
+        )
+
+
+# =========================
+class loader_sink:  # pylint: disable=too-many-instance-attributes
+
+    # feeds the finished records to a loader from a pool of threads instead of
+    # writing a file. The queue is bounded so the mapper waits for a slow loader
+    def __init__(  # pylint: disable=too-many-arguments,too-many-positional-arguments
+        self,
+        loader,
+        threads=4,
+        batch_size=100,
+        max_retries=3,
+        retry_delay=1.0,
+        codec=None,
+    ):
+        self.loader = loader
+        self.batch_size = batch_size
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.codec = codec if codec else json_codec()
+        self.row_count = 0
+        self.loaded_count = 0
+        self.deleted_count = 0
+        self.retry_count = 0
+        self.failed_records = []
+        self.lock = threading.Lock()
+        self.batch = []
+        self.batch_queue = queue.Queue(maxsize=threads * 2)
+        self.threads = []
+        for _ in range(threads):
+            thread = threading.Thread(target=self.load_batches, daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def write(self, json_data, line=None):
+        if line is None:
+            line = self.codec.encode(json_data)
+        self.batch.append(
+            ("add", json_data["DATA_SOURCE"], json_data["RECORD_ID"], line)
+        )
+        self.row_count += 1
+        if len(self.batch) >= self.batch_size:
+            self.flush()
+        return line
+
+    def delete(self, json_data):
+        self.batch.append(
+            ("delete", json_data["DATA_SOURCE"], json_data["RECORD_ID"], None)
+        )
+        if len(self.batch) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if self.batch:
+            self.batch_queue.put(self.batch)
+            self.batch = []
+
+    def load_batches(self):
+        while True:
+            batch = self.batch_queue.get()
+            if batch is None:
+                break
+            for action, data_source, record_id, line in batch:
+                self.load_record(action, data_source, record_id, line)
+
+    def load_record(self, action, data_source, record_id, line):
+        for attempt in range(self.max_retries + 1):
+            try:
+                if action == "add":
+                    self.loader.add_record(data_source, record_id, line.decode("utf-8"))
+                else:
+                    self.loader.delete_record(data_source, record_id)
+                break
+            except load_error as err:
+                if attempt == self.max_retries:
+                    with self.lock:
+                        self.failed_records.append((action, record_id, str(err)))
+                    return
+                with self.lock:
+                    self.retry_count += 1
+                time.sleep(self.retry_delay * 2**attempt)
+            except Exception as err:  # pylint: disable=broad-exception-caught
+                # anything else is not retried, but must not kill the thread or
+                # the queue fills up and the mapper waits forever
+                with self.lock:
+                    self.failed_records.append(
+                        (action, record_id, f"{type(err).__name__}: {err}")
+                    )
+                return
+        with self.lock:
+            if action == "add":
+                self.loaded_count += 1
+            else:
+                self.deleted_count += 1
+
+    def close(self):
+        self.flush()
+        for _ in self.threads:
+            self.batch_queue.put(None)
+        for thread in self.threads:
+            thread.join()
+        self.loader.close()
+
+
+# =========================
+class senzing_loader:
+
+    # configured like the other senzing tools, from the engine configuration
+    # json in the SENZING_ENGINE_CONFIGURATION_JSON environment variable
+    def __init__(self, engine_config=None):
+        if not G2Engine:
+            raise ValueError("the senzing python sdk is not installed")
+        engine_config = engine_config or os.getenv("SENZING_ENGINE_CONFIGURATION_JSON")
+        if not engine_config:
+            raise ValueError("SENZING_ENGINE_CONFIGURATION_JSON is not set")
+        self.engine = G2Engine()
+        try:
+            self.engine.init("oor_mapper", engine_config, False)
+        except G2Exception as err:
+            raise ValueError(f"the senzing engine could not be started: {err}") from err
+
+    def add_record(self, data_source, record_id, json_string):
+        try:
+            self.engine.addRecord(data_source, record_id, json_string)
+        except G2Exception as err:
+            raise load_error(str(err)) from err
+
+    def delete_record(self, data_source, record_id):
+        try:
+            self.engine.deleteRecord(data_source, record_id)
+        except G2Exception as err:
+            raise load_error(str(err)) from err
+
+    def close(self):
+        self.engine.destroy()
+
+
+# =========================
+class stub_loader:
+
+    # stands in for senzing to try out the load stage. It can write what it
+    # receives to a file, and fail a share of the calls to exercise the retries
+    def __init__(self, file_name=None, failure_rate=0.0, delay_ms=0, seed=None):
+        self.file_handle = None
+        if file_name:
+            if file_name.endswith(".gz"):
+                self.file_handle = gzip.open(file_name, "wt", encoding="utf-8")
+            else:
+                self.file_handle = open(file_name, "w", encoding="utf-8")
+        self.failure_rate = failure_rate
+        self.delay_ms = delay_ms
+        self.random = random.Random(seed)
+        self.records = {}
+        self.lock = threading.Lock()
+
+    def call(self):
+        if self.delay_ms:
+            time.sleep(self.delay_ms / 1000)
+        with self.lock:
+            if self.failure_rate and self.random.random() < self.failure_rate:
+                raise load_error("stub loader failure")
+
+    def add_record(self, data_source, record_id, json_string):
+        self.call()
+        with self.lock:
+            self.records[(data_source, record_id)] = json_string
+            if self.file_handle:
+                self.file_handle.write(json_string + "\n")
+
+    def delete_record(self, data_source, record_id):
+        self.call()
+        with self.lock:
+            self.records.pop((data_source, record_id), None)
+
+    def close(self):
+        if self.file_handle:
+            self.file_handle.close()
+
+
+def read_fingerprints(file_name):
+    open_function = gzip.open if file_name.endswith(".gz") else open
+    with open_function(file_name, "rt", encoding="utf-8") as infile:
+        for line in infile:
+            record_id, fingerprint = line.rstrip("\n").split("\t")
+            yield record_id, fingerprint
+
+
+# =========================
+class fingerprint_index:
+
+    # writes a RECORD_ID -> content hash line per record and, given the previous
+    # run's index, classifies each record as added, changed or unchanged. The
+    # statements an entity or person replaces are collected while the input is
+    # read, so the superseded records are left out when they are written
+    def __init__(self, file_name, previous_file_name=None, partition=None):
+        self.file_name = file_name
+        self.partition = partition
+        open_function = gzip.open if file_name.endswith(".gz") else open
+        self.file_handle = open_function(file_name, "wt", encoding="utf-8")
+        self.previous = {}
+        if previous_file_name:
+            # the previous run may not have been partitioned
+            for record_id, fingerprint in read_fingerprints(previous_file_name):
+                if not partition or in_partition(record_id, partition):
+                    self.previous[record_id] = bytes.fromhex(fingerprint)
+        self.replaced_ids = set()
+        self.replaced_deletes = []
+
+    def add_replaced(self, json_data):
+        for replaced_data in json_data.get("replaces_statements", []):
+            if not self.partition or in_partition(
+                replaced_data["statementID"], self.partition
+            ):
+                self.replaced_ids.add(replaced_data["statementID"])
+
+    def add(self, json_data, line):
+        record_id = json_data["RECORD_ID"]
+        if record_id in self.replaced_ids:
+            # not written or fingerprinted, and deleted if the previous run had it
+            if self.previous.pop(record_id, None) is not None:
+                self.replaced_deletes.append(record_id)
+            return "superseded"
+        fingerprint = hashlib.blake2b(line, digest_size=16).digest()
+        self.file_handle.write(f"{record_id}\t{fingerprint.hex()}\n")
+        previous = self.previous.pop(record_id, None)
+        if previous is None:
+            return "added"
+        return "unchanged" if previous == fingerprint else "changed"
+
+    def close(self):
+        self.file_handle.close()
+
+    def get_deletes(self):
+        for record_id in self.replaced_deletes:
+            yield record_id, "replaced"
+        # whatever is left of the previous run is gone
+        for record_id in self.previous:
+            yield record_id, "replaced" if record_id in self.replaced_ids else "deleted"
+
+
+def get_input_files(input_path):
+    # a directory or a wildcard pattern is read as one stream in file name order.
+    # in a directory only the json, jsonl and gz files that are not hidden are read
+    # an existing file is read as named, even with [, ], * or ? in its name
+    if os.path.isfile(input_path):
+        return [input_path]
+    if os.path.isdir(input_path):
+        file_list = [
+            os.path.join(input_path, x)
+            for x in os.listdir(input_path)
+            if not x.startswith(".") and x.lower().endswith((".json", ".jsonl", ".gz"))
+        ]
+    elif glob.has_magic(input_path):
+        file_list = glob.glob(input_path)
+    else:
+        file_list = []
+    return sorted(x for x in file_list if os.path.isfile(x))
+
+
+# =========================
+class input_reader:
+
+    # reads one or more plain or gzip files as one stream of lines. with read
+    # ahead a background thread reads and decompresses line aligned blocks while
+    # the rows are mapped, as zlib releases the GIL while it decompresses
+    def __init__(
+        self, input_path, input_offset=0, read_ahead_mb=64, block_size=1048576
+    ):
+        self.file_list = get_input_files(input_path)
+        self.input_offset = input_offset
+        self.block_size = block_size
+        self.read_ahead_blocks = (read_ahead_mb * 1048576) // block_size
+        self.lines = None
+        self.error = None
+        self.stop_event = threading.Event()
+
+    def __iter__(self):
+        self.lines = self.get_lines()
+        return self.lines
+
+    def get_lines(self):
+        if self.read_ahead_blocks:
+            blocks = self.read_ahead()
+        else:
+            blocks = self.get_blocks()
+        try:
+            for block in blocks:
+                # lines stay as bytes, the codec decodes them
+                yield from io.BytesIO(block)
+        finally:
+            blocks.close()
+
+    def get_blocks(self):
+        skip_bytes = self.input_offset
+        for file_name in self.file_list:
+            if file_name.upper().endswith(".GZ"):
+                file_handle = gzip.open(file_name, "rb")
+            else:
+                file_handle = open(file_name, "rb")
+            try:
+                if skip_bytes:
+                    # zlib state cannot be saved, so a gzip file is decompressed
+                    # up to the offset without parsing any rows
+                    if file_name.upper().endswith(".GZ"):
+                        skip_bytes -= file_handle.seek(skip_bytes)
+                    else:
+                        skipped = min(skip_bytes, os.path.getsize(file_name))
+                        file_handle.seek(skipped)
+                        skip_bytes -= skipped
+                    if skip_bytes:
+                        continue
+                remainder = b""
+                while not self.stop_event.is_set():
+                    data = file_handle.read(self.block_size)
+                    if not data:
+                        break
+                    data = remainder + data
+                    cut = data.rfind(b"\n") + 1
+                    remainder = data[cut:]
+                    if cut:
+                        yield data[:cut]
+                if remainder:
+                    yield remainder
+            finally:
+                file_handle.close()
+
+    def read_ahead(self):
+        block_queue = queue.Queue(maxsize=self.read_ahead_blocks)
+        thread = threading.Thread(
+            target=self.read_blocks, args=(block_queue,), daemon=True
+        )
+        thread.start()
+        try:
+            while True:
+                block = block_queue.get()
+                if block is None:
+                    break
+                yield block
+            if self.error:
+                raise self.error
+        finally:
+            self.stop_event.set()
+            while thread.is_alive():
+                try:
+                    block_queue.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+            thread.join()
+
+    def read_blocks(self, block_queue):
+        completed = False
+        try:
+            for block in self.get_blocks():
+                self.put_block(block_queue, block)
+            completed = True
+        except (OSError, EOFError, zlib.error) as err:
+            self.error = err
+        finally:
+            # the main thread must never take a failed read for the end of the input
+            if not completed and not self.error:
+                self.error = RuntimeError("the input reader thread stopped")
+            self.put_block(block_queue, None)
+
+    def put_block(self, block_queue, block):
+        while not self.stop_event.is_set():
+            try:
+                block_queue.put(block, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def close(self):
+        if self.lines:
+            self.lines.close()
+
+
+def save_checkpoint(checkpoint_file, checkpoint_data, merge_store, previous=None):
+    checkpoint_data["merge_store_state"] = merge_store.save_state(
+        checkpoint_file, checkpoint_data["input_row_count"]
+    )
+    temp_file_name = checkpoint_file + ".tmp"
+    with open(temp_file_name, "w") as outfile:
+        json.dump(checkpoint_data, outfile)
+    os.replace(temp_file_name, checkpoint_file)
+    if (
+        previous
+        and previous["merge_store_state"] != checkpoint_data["merge_store_state"]
+    ):
+        merge_store.remove_state(previous["merge_store_state"])
+    return checkpoint_data
+
+
+def load_checkpoint(checkpoint_file):
+    with open(checkpoint_file, "r") as infile:
+        return json.load(infile)
+
+
+def get_rss_mb():
+    try:
+        with open("/proc/self/statm", "r") as infile:
+            resident_pages = int(infile.read().split()[1])
+        return round(resident_pages * os.sysconf("SC_PAGE_SIZE") / 1048576, 1)
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+# =========================
+class run_metrics:  # pylint: disable=too-many-instance-attributes
+
+    # the stages are timed per chunk of rows and callers skip all of it when
+    # metrics are disabled, so a run without a metrics file pays nothing
+    def __init__(self, file_name, file_format="json", interval=60):
+        self.file_name = file_name
+        self.file_format = file_format
+        self.interval = interval
+        self.stage_times = {
+            "read": 0.0,
+            "decode": 0.0,
+            "map": 0.0,
+            "merge": 0.0,
+            "write": 0.0,
+        }
+        self.phase = "starting"
+        self.rows_read = 0
+        self.records_written = 0
+        self.merge_store_size = 0
+        self.start_time = time.time()
+        self.last_time = self.start_time
+        self.last_rows_read = 0
+        self.last_records_written = 0
+        if file_format == "json":
+            open(file_name, "w").close()
+
+    def add_time(self, stage, seconds):
+        self.stage_times[stage] += seconds
+
+    def add_times(self, stage_times):
+        for stage, seconds in stage_times.items():
+            self.stage_times[stage] += seconds
+
+    def due(self):
+        return time.time() - self.last_time >= self.interval
+
+    def emit(self, merge_store_size=None):
+        if merge_store_size is not None:
+            self.merge_store_size = merge_store_size
+        current_time = time.time()
+        interval_seconds = max(current_time - self.last_time, 0.001)
+        snapshot = {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(current_time)),
+            "elapsed_seconds": round(current_time - self.start_time, 1),
+            "phase": self.phase,
+            "rows_read": self.rows_read,
+            "rows_per_second": round(
+                (self.rows_read - self.last_rows_read) / interval_seconds
+            ),
+            "records_written": self.records_written,
+            "records_per_second": round(
+                (self.records_written - self.last_records_written) / interval_seconds
+            ),
+            "merge_store_size": self.merge_store_size,
+            "rss_mb": get_rss_mb(),
+            "stage_seconds": {x: round(y, 3) for x, y in self.stage_times.items()},
+        }
+        self.last_time = current_time
+        self.last_rows_read = self.rows_read
+        self.last_records_written = self.records_written
+
+        if self.file_format == "prometheus":
+            self.write_prometheus(snapshot)
+        else:
+            with open(self.file_name, "a") as outfile:
+                outfile.write(json.dumps(snapshot) + "\n")
+        return snapshot
+
+    def write_prometheus(self, snapshot):
+        # a text file for the node exporter's textfile collector, replaced whole
+        metric_list = [
+            ("elapsed_seconds", "gauge", snapshot["elapsed_seconds"]),
+            ("rows_read_total", "counter", snapshot["rows_read"]),
+            ("rows_per_second", "gauge", snapshot["rows_per_second"]),
+            ("records_written_total", "counter", snapshot["records_written"]),
+            ("records_per_second", "gauge", snapshot["records_per_second"]),
+            ("merge_store_records", "gauge", snapshot["merge_store_size"]),
+        ]
+        if snapshot["rss_mb"] is not None:
+            metric_list.append(
+                ("rss_bytes", "gauge", int(snapshot["rss_mb"] * 1048576))
+            )
+        lines = []
+        for metric_name, metric_type, value in metric_list:
+            lines.append(f"# TYPE oor_mapper_{metric_name} {metric_type}")
+            lines.append(f"oor_mapper_{metric_name} {value}")
+        lines.append("# TYPE oor_mapper_stage_seconds_total counter")
+        for stage, seconds in snapshot["stage_seconds"].items():
+            lines.append(f'oor_mapper_stage_seconds_total{{stage="{stage}"}} {seconds}')
+        lines.append("# TYPE oor_mapper_phase gauge")
+        lines.append(f'oor_mapper_phase{{phase="{snapshot["phase"]}"}} 1')
+
+        temp_file_name = self.file_name + ".tmp"
+        with open(temp_file_name, "w") as outfile:
+            outfile.write("\n".join(lines) + "\n")
+        os.replace(temp_file_name, self.file_name)
+
+
+def map_replaces(raw_data):
+    # what is kept of an entity or person that is not mapped, in pass one of the
+    # streaming mode or in another partition: the statements it replaces, if
+    # any, without a RECORD_ID. A malformed list is left for mapping to report
+    if raw_data.get("statementType") == "ownershipOrControlStatement":
+        return None
+    if not isinstance(raw_data.get("replacesStatements"), list):
+        return None
+    if not raw_data.get("replacesStatements"):
+        return None
+    return {
+        "replaces_statements": [
+            {"statementID": x} for x in raw_data.get("replacesStatements")
+        ]
+    }
+
+
+def map_lines(  # pylint: disable=too-many-arguments,too-many-positional-arguments
+    record_mapper,
+    codec,
+    start_row_num,
+    lines,
+    statement_types=None,
+    stage_times=None,
+    errors=None,
+    partition=None,
+):
+    # rows that fail are added to errors as (row number, reason, message, line)
+    # and mapped to None, or raise when no errors list is given. With a
+    # partition, rows merging into another partition's records are not mapped
+    # and rows that cannot be placed are left to the first partition to report.
+    # Rows of a skipped statement type or another partition map to None or, for
+    # an entity or person that replaces statements, to the fragment from
+    # map_replaces, as the statements it replaces may be in this partition
+    if stage_times is not None:
+        start_time = time.perf_counter()
+    # the rows are read again and looked up by number when one fails
+    lines = lines if isinstance(lines, list) else list(lines)
+    # marks the rows that failed to decode, as a line may decode to None
+    decode_failed = object()
+    try:
+        raw_list = [
+            line if isinstance(line, dict) else codec.decode(line) for line in lines
+        ]
+    except ValueError:
+        if errors is None:
+            raise
+        raw_list = []
+        for input_row_num, line in enumerate(lines, start_row_num):
+            try:
+                raw_list.append(line if isinstance(line, dict) else codec.decode(line))
+            except ValueError as err:
+                if not partition or partition[0] == 0:
+                    errors.append((input_row_num, "invalid-json", str(err), line))
+                raw_list.append(decode_failed)
+    if stage_times is not None:
+        decode_time = time.perf_counter()
+        stage_times["decode"] += decode_time - start_time
+
+    # only statements of the other known types are skipped, so unknown types
+    # are reported whatever the filter
+    skipped_types = set(record_mapper.statement_types).difference(
+        statement_types or record_mapper.statement_types
+    )
+    mapped_list = []
+    for input_row_num, raw_data in enumerate(raw_list, start_row_num):
+        try:
+            if raw_data is decode_failed:
+                mapped_list.append(None)
+                continue
+            if raw_data.get("statementType") in skipped_types:
+                mapped_list.append(map_replaces(raw_data))
+                continue
+            if partition:
+                try:
+                    record_id = record_mapper.get_record_id(raw_data)
+                except (KeyError, TypeError, AttributeError):
+                    record_id = None
+                if isinstance(record_id, str) and record_id:
+                    if not in_partition(record_id, partition):
+                        mapped_list.append(map_replaces(raw_data))
+                        continue
+                elif partition[0] != 0:
+                    mapped_list.append(None)
+                    continue
+            mapped_list.append(record_mapper.map(raw_data, input_row_num))
+        except (mapping_error, KeyError, TypeError, AttributeError, ValueError) as err:
+            if errors is None:
+                raise
+            if isinstance(err, mapping_error):
+                reason = err.reason
+            elif isinstance(err, KeyError):
+                reason = f"missing-{err.args[0]}"
+            else:
+                reason = "invalid-statement"
+            errors.append(
+                (input_row_num, reason, str(err), lines[input_row_num - start_row_num])
+            )
+            mapped_list.append(None)
+    if stage_times is not None:
+        stage_times["map"] += time.perf_counter() - decode_time
+    return mapped_list
+
+
+def map_many(batch, record_mapper=None, codec=None, start_row_num=1, errors=None):
+    # maps a batch of statements, as json lines in bytes or str or as decoded
+    # dicts, to one mapped fragment per statement. Relationships come back as
+    # fragments of their subject and still need merging, see map_stream
+    if not record_mapper:
+        record_mapper = mapper("none")
+    if not codec:
+        codec = json_codec()
+    mapped_list = map_lines(record_mapper, codec, start_row_num, batch, errors=errors)
+    return [
+        expand_relationships(record_mapper.consolidate_relationships(x)) if x else x
+        for x in mapped_list
+    ]
+
+
+def map_stream(  # pylint: disable=too-many-arguments,too-many-positional-arguments
+    statements,
+    record_mapper=None,
+    codec=None,
+    merge_store=None,
+    batch_size=1000,
+    errors=None,
+):
+    # generator over the finished senzing records for an iterable of statements,
+    # for use as a library. All the statements are read before the first record
+    # is yielded as a relationship can come after its subject
+    if not record_mapper:
+        record_mapper = mapper("none")
+    if not codec:
+        codec = json_codec()
+    if merge_store is None:
+        merge_store = memory_merge_store()
+
+    def merge_batch(start_row_num, batch):
+        error_count = len(errors) if errors is not None else 0
+        mapped_list = map_lines(
+            record_mapper, codec, start_row_num, batch, errors=errors
+        )
+        for json_data in mapped_list:
+            if json_data:
+                merge_store.add(json_data)
+        if errors:
+            for input_row_num, reason, _, _ in errors[error_count:]:
+                record_mapper.update_stat("!errors", reason, value=input_row_num)
+
+    batch = []
+    start_row_num = 1
+    for statement in statements:
+        batch.append(statement)
+        if len(batch) == batch_size:
+            merge_batch(start_row_num, batch)
+            start_row_num += len(batch)
+            batch = []
+    if batch:
+        merge_batch(start_row_num, batch)
+
+    for json_data in merge_store.get_records():
+        if finish_record(record_mapper, json_data):
+            yield json_data
+
+
+# set in each worker process by init_worker
+worker_mapper = None
+worker_codec = None
+worker_timed = False
+worker_partition = None
+
+
+def init_worker(  # pylint: disable=too-many-arguments,too-many-positional-arguments
+    json_backend,
+    stats_level,
+    timed,
+    conversions,
+    prune_empty,
+    partition,
+    collapse_replaced=False,
+):
+    # the parent handles the user interrupt and stops feeding the pool
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    global worker_mapper, worker_codec, worker_timed, worker_partition
+    worker_mapper = mapper(
+        stats_level,
+        collapse_replaced=collapse_replaced,
+        conversions=conversions,
+        prune_empty=prune_empty,
+    )
+    worker_codec = json_codec(json_backend)
+    worker_timed = timed
+    worker_partition = partition
+
+
+def map_chunk(chunk):
+    start_row_num, lines, statement_types = chunk
+    worker_mapper.reset_stats()
+    stage_times = {"decode": 0.0, "map": 0.0} if worker_timed else None
+    error_list = []
+    mapped_list = map_lines(
+        worker_mapper,
+        worker_codec,
+        start_row_num,
+        lines,
+        statement_types,
+        stage_times,
+        error_list,
+        worker_partition,
+    )
+    return (
+        mapped_list,
+        sum(len(line) for line in lines),
+        error_list,
+        worker_mapper.stat_counts,
+        worker_mapper.stat_samples,
+        stage_times,
+    )
+
+
+def read_chunks(
+    file_reader, chunk_size, statement_types=None, start_row_num=1, stage_times=None
+):
+    lines = []
+    if stage_times is not None:
+        start_time = time.perf_counter()
+    for line in file_reader:
+        lines.append(line)
+        if len(lines) == chunk_size:
+            if stage_times is not None:
+                stage_times["read"] += time.perf_counter() - start_time
+            yield start_row_num, lines, statement_types
+            if stage_times is not None:
+                start_time = time.perf_counter()
+            start_row_num += len(lines)
+            lines = []
+    if stage_times is not None:
+        stage_times["read"] += time.perf_counter() - start_time
+    if lines:
+        yield start_row_num, lines, statement_types
+
+
+def map_rows(  # pylint: disable=too-many-arguments,too-many-positional-arguments
+    file_reader,
+    record_mapper,
+    codec,
+    workers=0,
+    chunk_size=1000,
+    statement_types=None,
+    start_row_num=1,
+    metrics=None,
+    partition=None,
+):
+    # yields a list of mapped records (or None) per chunk of input rows, the
+    # number of bytes they were read from and the rows that failed, in input order
+    stage_times = metrics.stage_times if metrics else None
+    chunks = read_chunks(
+        file_reader, chunk_size, statement_types, start_row_num, stage_times
+    )
+    if workers > 1:
+        # imap returns chunks in input order so merging matches a serial run
+        worker_pool = multiprocessing.Pool(
+            workers,
+            initializer=init_worker,
+            initargs=(
+                codec.backend,
+                record_mapper.stats_level,
+                bool(metrics),
+                record_mapper.conversions,
+                record_mapper.prune_empty,
+                partition,
+                record_mapper.collapse_replaced,
+            ),
+        )
+        completed = False
+        try:
+            chunk_iterator = worker_pool.imap(map_chunk, chunks)
+            for chunk_results in chunk_iterator:
+                (
+                    mapped_list,
+                    bytes_read,
+                    error_list,
+                    stat_counts,
+                    stat_samples,
+                    worker_times,
+                ) = chunk_results
+                record_mapper.merge_stats(stat_counts, stat_samples)
+                if worker_times:
+                    metrics.add_times(worker_times)
+                yield mapped_list, bytes_read, error_list
+            completed = True
+        finally:
+            if completed:
+                worker_pool.close()
+            else:
+                worker_pool.terminate()
+            worker_pool.join()
+    else:
+        for chunk_start_row_num, lines, chunk_statement_types in chunks:
+            error_list = []
+            mapped_list = map_lines(
+                record_mapper,
+                codec,
+                chunk_start_row_num,
+                lines,
+                chunk_statement_types,
+                stage_times,
+                error_list,
+                partition,
+            )
+            yield mapped_list, sum(len(line) for line in lines), error_list
+
+
+def add_mapping_arguments(parser):
+    # the options that decide how statements are read and mapped, shared with
+    # oor_benchmark.py so a benchmark runs the configuration it measures
+    parser.add_argument(
+        "-m",
+        "--merge_store",
+        dest="merge_store",
+        choices=["memory", "sqlite"],
+        default="memory",
+        help="where records are merged before writing: memory (fastest) or sqlite (bounded memory, spills to disk)",
+    )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        dest="workers",
+        type=int,
+        default=0,
+        help="optional number of processes to map with, defaults to mapping in this process",
+    )
+    parser.add_argument(
+        "--chunk_size",
+        dest="chunk_size",
+        type=int,
+        default=1000,
+        help="number of input rows sent to a worker at a time, defaults to 1000",
+    )
+    parser.add_argument(
+        "--json_backend",
+        dest="json_backend",
+        choices=["auto", "orjson", "stdlib"],
+        default="auto",
+        help="json library to read and write with, defaults to orjson when it is installed",
+    )
+    parser.add_argument(
+        "--stats_level",
+        dest="stats_level",
+        choices=["none", "basic", "full"],
+        default="full",
+        help="statistics to collect: none, basic (alerts and record counts) or full (every attribute), defaults to full",
+    )
+    parser.add_argument(
+        "--read_ahead_mb",
+        dest="read_ahead_mb",
+        type=int,
+        default=64,
+        help="megabytes of input a background thread reads and decompresses ahead of the mapper, 0 to disable, defaults to 64",
+    )
+    parser.add_argument(
+        "--keep_empty_values",
+        dest="keep_empty_values",
+        action="store_true",
+        default=False,
+        help="write blank attributes like an empty ADDR_COUNTRY instead of leaving them out",
+    )
+
+
 def signal_handler(signal, frame):
     print("USER INTERRUPT! Shutting down ... (please wait)")
     global shut_down
@@ -387,6 +2400,7 @@ def signal_handler(signal, frame):
 if __name__ == "__main__":
     proc_start_time = time.time()
     shut_down = False
+    too_many_errors = False
     signal.signal(signal.SIGINT, signal_handler)
 
     input_file = "<input_file_name>"
@@ -398,7 +2412,7 @@ if __name__ == "__main__":
         "--input_file",
         dest="input_file",
         default=input_file,
-        help="the name of the input file",
+        help="the name of the input file, or a directory or wildcard pattern of files to read in name order",
     )
     parser.add_argument(
         "-o", "--output_file", dest="output_file", help="the name of the output file"
@@ -409,87 +2423,645 @@ if __name__ == "__main__":
         dest="log_file",
         help="optional name of the statistics log file",
     )
+    add_mapping_arguments(parser)
+    parser.add_argument(
+        "--merge_store_path",
+        dest="merge_store_path",
+        help="optional sqlite merge store file, defaults to a temporary file next to the output file",
+    )
+    parser.add_argument(
+        "--merge_store_cache_mb",
+        dest="merge_store_cache_mb",
+        type=int,
+        default=256,
+        help="sqlite page cache size in megabytes, defaults to 256",
+    )
+    parser.add_argument(
+        "-s",
+        "--streaming",
+        dest="streaming",
+        action="store_true",
+        default=False,
+        help="read the input file twice, writing each record as soon as it is read instead of merging them all first",
+    )
+    parser.add_argument(
+        "--verify_codec",
+        dest="verify_codec",
+        action="store_true",
+        default=False,
+        help="check every record is written byte for byte the same by the stdlib json backend",
+    )
+    parser.add_argument(
+        "-c",
+        "--checkpoint_file",
+        dest="checkpoint_file",
+        help="optional file to periodically save progress to so an interrupted run can be resumed",
+    )
+    parser.add_argument(
+        "--checkpoint_interval",
+        dest="checkpoint_interval",
+        type=int,
+        default=1000000,
+        help="number of input rows between checkpoints, defaults to 1,000,000",
+    )
+    parser.add_argument(
+        "-r",
+        "--resume",
+        dest="resume",
+        action="store_true",
+        default=False,
+        help="continue from the last checkpoint saved to the checkpoint file",
+    )
+    parser.add_argument(
+        "--shards",
+        dest="shards",
+        type=int,
+        default=1,
+        help="optional number of output files to partition the records into by RECORD_ID",
+    )
+    parser.add_argument(
+        "--max_records_per_file",
+        dest="max_records_per_file",
+        type=int,
+        default=0,
+        help="optional number of records after which a new output file is started",
+    )
+    parser.add_argument(
+        "-f",
+        "--fingerprint_file",
+        dest="fingerprint_file",
+        help="optional file to write a RECORD_ID and content hash per record to, for the next delta run, records superseded by the replacesStatements of an entity or person are then left out of the output",
+    )
+    parser.add_argument(
+        "-p",
+        "--previous_fingerprints",
+        dest="previous_fingerprints",
+        help="fingerprint file of the previous run, only added and changed records are written",
+    )
+    parser.add_argument(
+        "--delete_file",
+        dest="delete_file",
+        help="where a delta run writes the records to delete, defaults to the output file name with _deletes added",
+    )
+    parser.add_argument(
+        "--metrics_file",
+        dest="metrics_file",
+        help="optional file to periodically write stage timings, throughput and memory to",
+    )
+    parser.add_argument(
+        "--metrics_format",
+        dest="metrics_format",
+        choices=["json", "prometheus"],
+        help="json appends a line per interval, prometheus rewrites a text exposition file, defaults to prometheus for .prom files",
+    )
+    parser.add_argument(
+        "--metrics_interval",
+        dest="metrics_interval",
+        type=int,
+        default=60,
+        help="seconds between metrics updates, defaults to 60",
+    )
+    parser.add_argument(
+        "--loader",
+        dest="loader",
+        choices=["senzing", "stub"],
+        help="load the records straight into senzing instead of writing an output file, stub only counts them for testing",
+    )
+    parser.add_argument(
+        "--load_threads",
+        dest="load_threads",
+        type=int,
+        default=4,
+        help="number of threads adding records to the loader, defaults to 4",
+    )
+    parser.add_argument(
+        "--load_batch_size",
+        dest="load_batch_size",
+        type=int,
+        default=100,
+        help="number of records handed to a load thread at a time, defaults to 100",
+    )
+    parser.add_argument(
+        "--load_retries",
+        dest="load_retries",
+        type=int,
+        default=3,
+        help="number of times to retry a record the loader fails on, defaults to 3",
+    )
+    parser.add_argument(
+        "--keep_duplicate_relationships",
+        dest="keep_duplicate_relationships",
+        action="store_true",
+        default=False,
+        help="write a relationship stated more than once as often as it is stated",
+    )
+    parser.add_argument(
+        "--collapse_replaced",
+        dest="collapse_replaced",
+        action="store_true",
+        default=False,
+        help="drop the relationships of ownership statements that a later statement replaces",
+    )
+    parser.add_argument(
+        "-q",
+        "--quarantine_file",
+        dest="quarantine_file",
+        help="file to write the rows that cannot be mapped to, defaults to the output file name with _quarantine added",
+    )
+    parser.add_argument(
+        "--max_errors",
+        dest="max_errors",
+        type=int,
+        help="stop the run once more than this many rows could not be mapped, there is no limit by default",
+    )
+    parser.add_argument(
+        "--conversion_file",
+        dest="conversion_file",
+        help="the address type, identifier scheme, role and link conversions to use, defaults to oor_conversions.json next to the mapper",
+    )
+    parser.add_argument(
+        "--partition",
+        dest="partition",
+        help="only map the records of partition i of N, given as i/N, so N runs on separate machines together map the whole file",
+    )
+    parser.add_argument(
+        "--columnar_dir",
+        dest="columnar_dir",
+        help="optional directory to also export the records to as records, names, addresses, identifiers, relationships and attributes tables",
+    )
+    parser.add_argument(
+        "--columnar_format",
+        dest="columnar_format",
+        choices=["parquet", "csv"],
+        help="parquet needs pyarrow, defaults to parquet when it is installed and to gzipped csv otherwise",
+    )
+    parser.add_argument(
+        "--columnar_batch_size",
+        dest="columnar_batch_size",
+        type=int,
+        default=50000,
+        help="number of records exported at a time, defaults to 50000",
+    )
     args = parser.parse_args()
 
-    if not args.input_file or not os.path.exists(args.input_file):
+    if not args.input_file or not get_input_files(args.input_file):
         print("\nPlease supply a valid input file name on the command line\n")
         sys.exit(1)
-    if not args.output_file:
+    if not args.output_file and not args.loader:
         print("\nPlease supply a valid output file name on the command line\n")
         sys.exit(1)
+    if args.output_file and args.loader:
+        print("\nPlease supply either an output file or a loader, not both\n")
+        sys.exit(1)
+    if args.loader and (args.shards > 1 or args.max_records_per_file):
+        print("\nSharded output does not apply to a loader\n")
+        sys.exit(1)
+    if args.loader == "senzing" and not G2Engine:
+        print("\nThe senzing python sdk is not installed or not on the python path\n")
+        sys.exit(1)
+    if args.json_backend == "orjson" and not orjson:
+        print("\nThe orjson package is not installed, please use pip install orjson\n")
+        sys.exit(1)
+    if args.streaming and args.merge_store != "memory":
+        print("\nThe streaming mode does not use a merge store\n")
+        sys.exit(1)
+    if args.streaming and args.checkpoint_file:
+        print("\nCheckpoints are not supported in the streaming mode\n")
+        sys.exit(1)
+    if args.shards < 1:
+        print("\nThe number of shards must be at least 1\n")
+        sys.exit(1)
+    partition = None
+    if args.partition:
+        partition_parts = args.partition.split("/")
+        if (
+            len(partition_parts) != 2
+            or not all(x.isdigit() for x in partition_parts)
+            or not 1 <= int(partition_parts[0]) <= int(partition_parts[1])
+        ):
+            print("\nThe partition must be given as i/N, for instance 1/4\n")
+            sys.exit(1)
+        partition = (int(partition_parts[0]) - 1, int(partition_parts[1]))
+    if args.columnar_format == "parquet" and not pyarrow:
+        print("\nPlease install pyarrow to export parquet tables\n")
+        sys.exit(1)
+    if args.previous_fingerprints and not os.path.exists(args.previous_fingerprints):
+        print("\nPlease supply a valid previous fingerprint file\n")
+        sys.exit(1)
+    if args.previous_fingerprints and not args.fingerprint_file:
+        print("\nPlease supply the fingerprint file to write for this run\n")
+        sys.exit(1)
+    if args.resume and not args.checkpoint_file:
+        print("\nPlease supply the checkpoint file to resume from\n")
+        sys.exit(1)
 
-    base_file_name, file_extension = os.path.splitext(args.input_file)
-    compressed_file = file_extension.upper() == ".GZ"
-    if compressed_file:
-        base_file_name, file_extension = os.path.splitext(base_file_name)
-        input_file_handle = gzip.open(args.input_file, "r")
-        file_reader = io.TextIOWrapper(
-            io.BufferedReader(input_file_handle), encoding="utf-8", errors="ignore"
+    codec = json_codec(args.json_backend)
+    verify_codec = json_codec("stdlib") if args.verify_codec else None
+    print(f"Using the {codec.backend} json backend")
+
+    try:
+        conversions = load_conversions(args.conversion_file)
+    except (OSError, ValueError) as err:
+        print(f"\nThe conversion file could not be loaded: {err}\n")
+        sys.exit(1)
+
+    record_mapper = mapper(
+        args.stats_level,
+        not args.keep_duplicate_relationships,
+        args.collapse_replaced,
+        conversions,
+        not args.keep_empty_values,
+    )
+    if args.loader:
+        if args.loader == "senzing":
+            try:
+                loader = senzing_loader()
+            except ValueError as err:
+                print(f"\nThe Senzing loader could not be started: {err}\n")
+                sys.exit(1)
+        else:
+            loader = stub_loader()
+        output_file = loader_sink(
+            loader,
+            args.load_threads,
+            args.load_batch_size,
+            args.load_retries,
+            codec=codec,
+        )
+    elif args.shards > 1 or args.max_records_per_file:
+        output_file = sharded_output_writer(
+            args.output_file, args.shards, args.max_records_per_file, codec
         )
     else:
-        # fixed unknown variable input_file_name
-        input_file_handle = open(args.input_file, "r")
-        file_reader = input_file_handle
+        output_file = output_writer(args.output_file, codec)
 
-    mapper = mapper()
+    columnar_file = None
+    if args.columnar_dir:
+        columnar_file = columnar_writer(
+            args.columnar_dir, args.columnar_format, args.columnar_batch_size
+        )
 
-    output_cache = {}
+    fingerprints = None
+    if args.fingerprint_file:
+        fingerprints = fingerprint_index(
+            args.fingerprint_file, args.previous_fingerprints, partition
+        )
+        if args.previous_fingerprints:
+            print(f"{len(fingerprints.previous):,} previous fingerprints loaded")
+
+    metrics = None
+    if args.metrics_file:
+        metrics_format = args.metrics_format
+        if not metrics_format:
+            metrics_format = (
+                "prometheus" if args.metrics_file.endswith(".prom") else "json"
+            )
+        metrics = run_metrics(args.metrics_file, metrics_format, args.metrics_interval)
+
+    def quarantine_rows(error_list):
+        global shut_down, too_many_errors
+        for input_row_num, reason, _, _ in error_list:
+            record_mapper.update_stat("!errors", reason, value=input_row_num)
+        quarantine.write(error_list)
+        if args.max_errors is not None and quarantine.error_count > args.max_errors:
+            if not too_many_errors:
+                print(f"\nMore than {args.max_errors:,} rows could not be mapped\n")
+            too_many_errors = True
+            shut_down = True
+
+    def write_record(json_data):
+        if metrics:
+            start_time = time.perf_counter()
+            save_record(json_data)
+            metrics.add_time("write", time.perf_counter() - start_time)
+            metrics.records_written = output_file.row_count
+            if metrics.due():
+                metrics.emit()
+        else:
+            save_record(json_data)
+
+    def save_record(json_data):
+        if not finish_record(record_mapper, json_data):
+            return
+        line = codec.encode(json_data)
+        if verify_codec and verify_codec.encode(json_data) != line:
+            record_mapper.update_stat(
+                "!alert", "codec-mismatch!", value=json_data["RECORD_ID"]
+            )
+        delta_status = fingerprints.add(json_data, line) if fingerprints else None
+        if delta_status == "superseded":
+            record_mapper.update_stat(
+                "!delta", delta_status, value=json_data["RECORD_ID"]
+            )
+            return
+        if columnar_file:
+            # the whole snapshot, even when a delta run only writes the changes
+            columnar_file.write(json_data)
+        if fingerprints and args.previous_fingerprints:
+            if delta_status == "unchanged":
+                record_mapper.update_stat("!delta", delta_status)
+                return
+            record_mapper.update_stat(
+                "!delta", delta_status, value=json_data["RECORD_ID"]
+            )
+        output_file.write(json_data, line)
+        if output_file.row_count % 10000 == 0:
+            print(f"{output_file.row_count:,} rows written")
+
+    quarantine_file_name = args.quarantine_file
+    if not quarantine_file_name and args.output_file:
+        quarantine_file_name = (
+            split_output_name(args.output_file)[0] + "_quarantine.jsonl"
+        )
 
     input_row_count = 0
-    for line in file_reader:
-        input_row_count += 1
-        input_row = json.loads(line)
-        json_data = mapper.map(input_row, input_row_count)
+    if args.streaming:
+        quarantine = quarantine_writer(quarantine_file_name)
+        # pass one indexes the relationships, pass two writes each entity and
+        # person as soon as it is read
+        rel_index = relationship_index()
+        file_reader = input_reader(args.input_file, read_ahead_mb=args.read_ahead_mb)
+        mapped_rows = map_rows(
+            file_reader,
+            record_mapper,
+            codec,
+            args.workers,
+            args.chunk_size,
+            ["ownershipOrControlStatement"],
+            metrics=metrics,
+            partition=partition,
+        )
+        if metrics:
+            metrics.phase = "indexing"
+        input_row_num = 0
+        error_rows = set()
+        for mapped_list, bytes_read, error_list in mapped_rows:
+            if error_list:
+                quarantine_rows(error_list)
+                error_rows.update(x[0] for x in error_list)
+            if metrics:
+                start_time = time.perf_counter()
+            for json_data in mapped_list:
+                input_row_num += 1
+                if json_data and "RECORD_ID" in json_data:
+                    rel_index.add(input_row_num, json_data)
+                elif json_data and fingerprints:
+                    fingerprints.add_replaced(json_data)
+                if input_row_num % 10000 == 0:
+                    print(f"{input_row_num:,} rows indexed")
+            if metrics:
+                metrics.add_time("merge", time.perf_counter() - start_time)
+                metrics.rows_read = input_row_num
+                if metrics.due():
+                    metrics.emit(len(rel_index))
+            if shut_down:
+                break
+        mapped_rows.close()
+        file_reader.close()
+        print(f"{len(rel_index):,} subjects with relationships indexed")
 
-        if json_data:
-            if json_data["RECORD_ID"] not in output_cache:
-                output_cache[json_data["RECORD_ID"]] = json_data
-            else:
-                for attr in json_data.keys():
-                    if attr == "RELATIONSHIPS":
-                        output_cache[json_data["RECORD_ID"]]["RELATIONSHIPS"].extend(
-                            json_data["RELATIONSHIPS"]
-                        )
-                    elif attr not in output_cache[json_data["RECORD_ID"]]:
-                        output_cache[json_data["RECORD_ID"]][attr] = json_data[attr]
-
-        if input_row_count % 10000 == 0:
-            print(f"{input_row_count:,} rows processed")
-        if shut_down:
-            break
-
-    if output_cache:
-        output_file_name = args.output_file
-        if output_file_name.endswith(".gz"):
-            output_file_handle = gzip.open(output_file_name, "wb")
-        else:
-            output_file_handle = open(output_file_name, "w", encoding="utf-8")
-
-        output_row_count = 0
-        for record_id in output_cache.keys():
-            if output_cache[record_id].get("RECORD_TYPE"):
-                mapper.capture_mapped_stats(output_cache[record_id])
-                if output_file_name.endswith(".gz"):
-                    output_file_handle.write(
-                        (json.dumps(output_cache[record_id]) + "\n").encode("utf-8")
-                    )
-                else:
-                    output_file_handle.write(
-                        (json.dumps(output_cache[record_id]) + "\n")
-                    )
-                output_row_count += 1
-                if output_row_count % 10000 == 0:
-                    print(f"{output_row_count:,} rows written")
+        if not shut_down:
+            file_reader = input_reader(
+                args.input_file, read_ahead_mb=args.read_ahead_mb
+            )
+            mapped_rows = map_rows(
+                file_reader,
+                record_mapper,
+                codec,
+                args.workers,
+                args.chunk_size,
+                ["entityStatement", "personStatement"],
+                metrics=metrics,
+                partition=partition,
+            )
+            if metrics:
+                metrics.phase = "writing"
+                metrics.rows_read = 0
+                metrics.last_rows_read = 0
+            for mapped_list, bytes_read, error_list in mapped_rows:
+                # rows that fail in both passes were quarantined by pass one
+                error_list = [x for x in error_list if x[0] not in error_rows]
+                if error_list:
+                    quarantine_rows(error_list)
+                if metrics:
+                    metrics.rows_read = input_row_count + len(mapped_list)
+                for json_data in mapped_list:
+                    input_row_count += 1
+                    # pass one already has what other partitions' rows replace
+                    if json_data and "RECORD_ID" in json_data:
+                        write_record(rel_index.merge(input_row_count, json_data))
+                    if input_row_count % 10000 == 0:
+                        print(f"{input_row_count:,} rows processed")
+                if shut_down:
+                    break
+            mapped_rows.close()
+            file_reader.close()
+
+        if not shut_down:
+            for record_id in rel_index.get_orphans():
+                write_record({"RECORD_ID": record_id})
+
+    else:
+        checkpoint = None
+        input_offset = 0
+        if args.resume:
+            if os.path.exists(args.checkpoint_file):
+                checkpoint = load_checkpoint(args.checkpoint_file)
             else:
-                mapper.update_stat(
-                    "!alert",
-                    "relationship-without-entity!",
-                    value=output_cache[record_id].get("RECORD_ID"),
+                print("No checkpoint found, starting from the beginning")
+        if checkpoint:
+            if checkpoint["input_file"] != os.path.abspath(args.input_file):
+                print(f"\nThe checkpoint is for {checkpoint['input_file']}\n")
+                sys.exit(1)
+            if checkpoint["merge_store"] != args.merge_store:
+                print(
+                    f"\nThe checkpoint uses the {checkpoint['merge_store']} merge store\n"
                 )
+                sys.exit(1)
+            if checkpoint.get("partition") != args.partition:
+                print(
+                    f"\nThe checkpoint is for partition {checkpoint.get('partition')}\n"
+                )
+                sys.exit(1)
+            input_row_count = checkpoint["input_row_count"]
+            input_offset = checkpoint["input_offset"]
+            record_mapper.restore_stats(checkpoint["stats"])
+            if fingerprints:
+                fingerprints.replaced_ids.update(checkpoint.get("replaced_ids", []))
+            print(f"Resuming after {input_row_count:,} rows")
+            quarantine = quarantine_writer(
+                quarantine_file_name,
+                checkpoint.get("error_count", 0),
+                checkpoint.get("quarantine_size"),
+            )
+        else:
+            quarantine = quarantine_writer(quarantine_file_name)
+
+        if args.merge_store == "sqlite":
+            merge_store_path = args.merge_store_path
+            if not merge_store_path and args.checkpoint_file:
+                merge_store_path = args.checkpoint_file + ".db"
+            merge_store = sqlite_merge_store(
+                merge_store_path,
+                cache_mb=args.merge_store_cache_mb,
+                temp_dir=(
+                    os.path.dirname(os.path.abspath(args.output_file))
+                    if args.output_file
+                    else None
+                ),
+                codec=codec,
+                resume=bool(checkpoint),
+                durable=bool(args.checkpoint_file),
+            )
+        else:
+            merge_store = memory_merge_store()
+        if checkpoint:
+            merge_store.restore_state(checkpoint["merge_store_state"])
+
+        def take_checkpoint(previous):
+            checkpoint_data = {
+                "input_file": os.path.abspath(args.input_file),
+                "input_row_count": input_row_count,
+                "input_offset": input_offset,
+                "merge_store": args.merge_store,
+                "partition": args.partition,
+                "stats": record_mapper.save_stats(),
+                "error_count": quarantine.error_count,
+                "quarantine_size": quarantine.tell(),
+            }
+            if fingerprints:
+                checkpoint_data["replaced_ids"] = sorted(fingerprints.replaced_ids)
+            return save_checkpoint(
+                args.checkpoint_file, checkpoint_data, merge_store, previous
+            )
 
+        file_reader = input_reader(
+            args.input_file, input_offset, read_ahead_mb=args.read_ahead_mb
+        )
+        mapped_rows = map_rows(
+            file_reader,
+            record_mapper,
+            codec,
+            args.workers,
+            args.chunk_size,
+            start_row_num=input_row_count + 1,
+            metrics=metrics,
+            partition=partition,
+        )
+        if metrics:
+            metrics.phase = "reading"
+        next_checkpoint = input_row_count + args.checkpoint_interval
+        for mapped_list, bytes_read, error_list in mapped_rows:
+            if error_list:
+                quarantine_rows(error_list)
+            if metrics:
+                start_time = time.perf_counter()
+            for json_data in mapped_list:
+                input_row_count += 1
+                if json_data and "RECORD_ID" in json_data:
+                    merge_store.add(json_data)
+                    if fingerprints:
+                        fingerprints.add_replaced(json_data)
+                elif json_data and fingerprints:
+                    fingerprints.add_replaced(json_data)
+
+                if input_row_count % 10000 == 0:
+                    print(f"{input_row_count:,} rows processed")
+            if metrics:
+                metrics.add_time("merge", time.perf_counter() - start_time)
+                metrics.rows_read = input_row_count
+                if metrics.due():
+                    metrics.emit(len(merge_store))
+            input_offset += bytes_read
             if shut_down:
                 break
-        print(f"{output_row_count:,} rows written. complete")
+            if args.checkpoint_file and input_row_count >= next_checkpoint:
+                checkpoint = take_checkpoint(checkpoint)
+                next_checkpoint = input_row_count + args.checkpoint_interval
+                print(f"Checkpoint saved after {input_row_count:,} rows")
+        mapped_rows.close()
+        file_reader.close()
+
+        if args.checkpoint_file:
+            # the final checkpoint lets an interrupted write start over without re-reading
+            checkpoint = take_checkpoint(checkpoint)
+
+        if shut_down and args.checkpoint_file:
+            print("Checkpoint saved, add --resume to continue")
+            merge_store.close(remove_file=False)
+        else:
+            if metrics:
+                metrics.phase = "writing"
+                metrics.emit(len(merge_store))
+            for json_data in merge_store.get_records():
+                write_record(json_data)
+                if shut_down:
+                    break
+            if args.checkpoint_file and not shut_down:
+                merge_store.remove_state(checkpoint["merge_store_state"])
+                merge_store.close(remove_file=not args.merge_store_path)
+                os.remove(args.checkpoint_file)
+            else:
+                merge_store.close()
+
+    if args.loader and fingerprints and args.previous_fingerprints and not shut_down:
+        fingerprints.close()
+        for record_id, delta_status in fingerprints.get_deletes():
+            output_file.delete(
+                {"DATA_SOURCE": "OPEN-OWNERSHIP", "RECORD_ID": record_id}
+            )
+            record_mapper.update_stat("!delta", delta_status, value=record_id)
+        fingerprints = None
+
+    output_file.close()
+    if columnar_file:
+        columnar_file.close()
+    output_row_count = output_file.row_count
+    print(f"{output_row_count:,} rows written. complete")
+    quarantine.close()
+    if quarantine.error_count:
+        print(
+            f"{quarantine.error_count:,} rows could not be mapped"
+            + (f", see {quarantine_file_name}" if quarantine_file_name else "")
+        )
+    if args.loader:
+        record_mapper.merge_stats(
+            {
+                ("!load", "loaded"): output_file.loaded_count,
+                ("!load", "deleted"): output_file.deleted_count,
+                ("!load", "retried"): output_file.retry_count,
+            },
+            {},
+        )
+        for action, record_id, error in output_file.failed_records:
+            record_mapper.update_stat("!load", f"{action}-failed!", value=record_id)
+        print(
+            f"{output_file.loaded_count:,} records loaded, {output_file.deleted_count:,} deleted, "
+            f"{len(output_file.failed_records):,} failed after {args.load_retries} retries"
+        )
+        if output_file.failed_records:
+            print(f"First failure: {output_file.failed_records[0][2]}")
+    if metrics:
+        metrics.phase = "aborted" if shut_down else "complete"
+        metrics.records_written = output_row_count
+        metrics.emit()
+        print(f"Run metrics written to {args.metrics_file}")
+
+    if fingerprints:
+        fingerprints.close()
+        if args.previous_fingerprints and not shut_down:
+            delete_file_name = args.delete_file
+            if not delete_file_name:
+                base_file_name, file_extension = split_output_name(args.output_file)
+                delete_file_name = base_file_name + "_deletes" + file_extension
+            delete_file = output_writer(delete_file_name, codec)
+            for record_id, delta_status in fingerprints.get_deletes():
+                delete_file.write(
+                    {"DATA_SOURCE": "OPEN-OWNERSHIP", "RECORD_ID": record_id}
+                )
+                record_mapper.update_stat("!delta", delta_status, value=record_id)
+            delete_file.close()
+            print(f"{delete_file.row_count:,} deletes written to {delete_file_name}")
 
     elapsed_mins = round((time.time() - proc_start_time) / 60, 1)
     run_status = (
@@ -499,13 +3071,10 @@ if __name__ == "__main__":
         f"{input_row_count:,} rows processed, {output_row_count:,} rows written, {run_status}\n"
     )
 
-    output_file_handle.close()
-    input_file_handle.close()
-
     # --write statistics file
     if args.log_file:
         with open(args.log_file, "w") as outfile:
-            json.dump(mapper.stat_pack, outfile, indent=4, sort_keys=True)
+            json.dump(record_mapper.stat_pack, outfile, indent=4, sort_keys=True)
         print("Mapping stats written to %s\n" % args.log_file)
 
-    sys.exit(0)
+    sys.exit(1 if too_many_errors else 0)
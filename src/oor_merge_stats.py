@@ -0,0 +1,41 @@
+#! /usr/bin/env python3
+
+import sys
+import argparse
+import json
+
+from oor_mapper import mapper
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "stats_files",
+        nargs="+",
+        help="the statistics files to merge, for instance one per partition",
+    )
+    parser.add_argument(
+        "-o",
+        "--output_file",
+        dest="output_file",
+        help="the name of the merged statistics file",
+    )
+    args = parser.parse_args()
+
+    if not args.output_file:
+        print("\nPlease supply a valid output file name on the command line\n")
+        sys.exit(1)
+
+    # counts are added up and the sample values kept in the order of the files
+    stats_mapper = mapper("basic")
+    for stats_file in args.stats_files:
+        with open(stats_file, "r") as infile:
+            stats_mapper.merge_stat_pack(json.load(infile))
+
+    with open(args.output_file, "w") as outfile:
+        json.dump(stats_mapper.stat_pack, outfile, indent=4, sort_keys=True)
+    print(
+        f"{len(args.stats_files):,} statistics files merged into {args.output_file}\n"
+    )
+
+    sys.exit(0)
@@ -0,0 +1,24 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+MAPPER_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src", "oor_mapper.py"
+)
+
+
+@pytest.fixture(name="run_mapper")
+def fixture_run_mapper():
+    # runs oor_mapper.py as the command line does and checks it succeeded
+    def run_mapper(*args):
+        result = subprocess.run(
+            [sys.executable, MAPPER_PATH, *[str(x) for x in args]],
+            capture_output=True,
+            check=False,
+        )
+        assert result.returncode == 0, result.stderr.decode()
+        return result
+
+    return run_mapper
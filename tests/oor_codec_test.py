@@ -0,0 +1,130 @@
+import json
+
+import pytest
+
+from oor_mapper import json_codec, mapper, map_many, rel_pointer
+
+RECORDS = [
+    {"RECORD_ID": "ascii", "NAMES": [{"PRIMARY_NAME_ORG": "Acme Limited"}]},
+    {"RECORD_ID": "non-ascii", "PRIMARY_NAME_FULL": "Zoë Åström 王秀英 😀"},
+    {"RECORD_ID": "controls", "ADDR_FULL": 'a\tb\nc "quoted" \\ \x1f \x7f  '},
+    {"RECORD_ID": "ints", "values": [0, -1, 2**63 - 1, -(2**63), 2**64 - 1]},
+    {
+        "RECORD_ID": "floats",
+        "values": [0.0, -0.0, 0.1, 2.5, 100.0, 1e15, 1e16, 1.5e16, 1e22, 1e300],
+    },
+    {"RECORD_ID": "small floats", "values": [1e-4, 1e-5, -1.25e-5, 1e-7, 5e-324]},
+    {"RECORD_ID": "literals", "values": [True, False, None, "", [], {}]},
+]
+
+
+@pytest.fixture(name="codecs")
+def fixture_codecs():
+    pytest.importorskip("orjson")
+    return json_codec("orjson"), json_codec("stdlib")
+
+
+@pytest.mark.parametrize("record", RECORDS, ids=[x["RECORD_ID"] for x in RECORDS])
+def test_encode_matches(codecs, record):
+    orjson_codec, stdlib_codec = codecs
+    assert orjson_codec.encode(record) == stdlib_codec.encode(record)
+    assert stdlib_codec.decode(stdlib_codec.encode(record)) == record
+
+
+def test_encode_fragment_matches(codecs):
+    orjson_codec, stdlib_codec = codecs
+    fragment = {
+        "RECORD_ID": "subject",
+        "RELATIONSHIPS": [
+            {"REL_ANCHOR_DOMAIN": "OOR", "REL_ANCHOR_KEY": "subject"},
+            rel_pointer("owner", "shareholding 25.5%", "2020-01-01", None, None),
+            rel_pointer("owner", "voting rights", None, "2021-12-31", "statement-1"),
+        ],
+        "replaced_ownership_statements": ["statement-0"],
+    }
+    line = orjson_codec.encode_fragment(fragment)
+    assert line == stdlib_codec.encode_fragment(fragment)
+    assert orjson_codec.loads(line) == stdlib_codec.loads(line)
+
+
+@pytest.mark.parametrize(
+    "line",
+    [
+        b'{"name":"\\u00e9\\ud83d\\ude00"}',
+        b'{"share":{"exact":1e16,"minimum":1.0E-5}}',
+        b'{"id":18446744073709551616}',
+        b'{"id":-9223372036854775809}',
+        b'{"name":"caf\xc3\xa9 \xff"}',
+        b'{"name":"not a surrogate \\\\ud800"}',
+    ],
+)
+def test_decode_matches(codecs, line):
+    orjson_codec, stdlib_codec = codecs
+    orjson_data = orjson_codec.decode(line)
+    stdlib_data = stdlib_codec.decode(line)
+    assert orjson_data == stdlib_data
+    assert orjson_codec.encode(orjson_data) == stdlib_codec.encode(stdlib_data)
+
+
+@pytest.mark.parametrize(
+    "line",
+    [
+        b'{"name":"A\\ud800B"}',
+        b'{"name":"\\udc00"}',
+        '{"name":"A\ud800B"}',
+        b'{"share":NaN}',
+        b'{"share":-Infinity}',
+        b'{"share":1e400}',
+    ],
+)
+def test_decode_rejects(codecs, line):
+    for codec in codecs:
+        with pytest.raises(ValueError):
+            codec.decode(line)
+
+
+@pytest.mark.parametrize("backend", ["orjson", "stdlib"])
+def test_map_many_quarantines_surrogates(backend):
+    if backend == "orjson":
+        pytest.importorskip("orjson")
+    errors = []
+    mapped_list = map_many(
+        [
+            b'{"statementID":"e1","statementType":"entityStatement",'
+            b'"statementDate":"2020-01-01","name":"A\\ud800B"}\n'
+        ],
+        mapper("none"),
+        json_codec(backend),
+        errors=errors,
+    )
+    assert mapped_list == [None]
+    assert [x[1] for x in errors] == ["invalid-json"]
+
+
+@pytest.mark.parametrize("merge_store", ["memory", "sqlite"])
+def test_run_quarantines_surrogates(tmp_path, run_mapper, merge_store):
+    input_file = tmp_path / "statements.jsonl"
+    input_file.write_text(
+        '{"statementID":"e1","statementType":"entityStatement",'
+        '"statementDate":"2020-01-01","name":"A\\ud800B"}\n'
+        '{"statementID":"e2","statementType":"entityStatement",'
+        '"statementDate":"2020-01-01","name":"Zoë 1e16"}\n',
+        encoding="utf-8",
+    )
+    output_file = tmp_path / "output.jsonl"
+    run_mapper(
+        "-i",
+        input_file,
+        "-o",
+        output_file,
+        "-m",
+        merge_store,
+        "--json_backend",
+        "stdlib",
+        "--verify_codec",
+    )
+    records = [json.loads(x) for x in output_file.read_text("utf-8").splitlines()]
+    assert [x["RECORD_ID"] for x in records] == ["e2"]
+    quarantine_file = tmp_path / "output_quarantine.jsonl"
+    errors = [json.loads(x) for x in quarantine_file.read_text("utf-8").splitlines()]
+    assert [(x["line_number"], x["reason"]) for x in errors] == [(1, "invalid-json")]
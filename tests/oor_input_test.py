@@ -0,0 +1,32 @@
+import gzip
+
+import pytest
+
+from oor_mapper import get_input_files, input_reader
+
+
+@pytest.mark.parametrize(
+    "file_name", ["statements[1].jsonl", "statements*.jsonl", "statements?.jsonl"]
+)
+def test_file_name_with_glob_characters(tmp_path, file_name):
+    input_file = tmp_path / file_name
+    input_file.write_bytes(b'{"statementID":"e1"}\n')
+    (tmp_path / "statements1.jsonl").write_bytes(b'{"statementID":"other"}\n')
+    assert get_input_files(str(input_file)) == [str(input_file)]
+    assert list(input_reader(str(input_file))) == [b'{"statementID":"e1"}\n']
+
+
+def test_directory_and_pattern(tmp_path):
+    with gzip.open(tmp_path / "part_2.jsonl.gz", "wb") as outfile:
+        outfile.write(b'{"statementID":"e2"}\n')
+    (tmp_path / "part_1.jsonl").write_bytes(b'{"statementID":"e1"}\n')
+    (tmp_path / "notes.txt").write_bytes(b"not a statement\n")
+    (tmp_path / ".hidden.jsonl").write_bytes(b"{}\n")
+    expected = [str(tmp_path / "part_1.jsonl"), str(tmp_path / "part_2.jsonl.gz")]
+    assert get_input_files(str(tmp_path)) == expected
+    assert get_input_files(str(tmp_path / "part_*")) == expected
+    assert list(input_reader(str(tmp_path))) == [
+        b'{"statementID":"e1"}\n',
+        b'{"statementID":"e2"}\n',
+    ]
+    assert not get_input_files(str(tmp_path / "missing.jsonl"))
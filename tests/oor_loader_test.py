@@ -0,0 +1,38 @@
+import threading
+
+from oor_mapper import load_error, loader_sink, stub_loader
+
+
+# =========================
+class broken_loader(stub_loader):
+
+    # fails some records with a load_error, which is retried, and the rest with
+    # an error the loader does not expect
+    def add_record(self, data_source, record_id, json_string):
+        if record_id.startswith("retry"):
+            raise load_error("busy")
+        if record_id.startswith("bad"):
+            raise RuntimeError("unexpected")
+        super().add_record(data_source, record_id, json_string)
+
+
+def test_failed_records_do_not_stop_the_threads():
+    loader = broken_loader()
+    sink = loader_sink(loader, threads=2, batch_size=2, max_retries=1, retry_delay=0)
+    record_ids = [f"{x}{y}" for y in range(20) for x in ("good", "bad", "retry")]
+    closed = threading.Event()
+
+    def write_and_close():
+        for record_id in record_ids:
+            sink.write({"DATA_SOURCE": "OPEN-OWNERSHIP", "RECORD_ID": record_id})
+        sink.close()
+        closed.set()
+
+    threading.Thread(target=write_and_close, daemon=True).start()
+    assert closed.wait(30)
+    assert sink.loaded_count == 20
+    assert sink.retry_count == 20
+    failures = {x[1]: x[2] for x in sink.failed_records}
+    assert len(failures) == 40
+    assert failures["bad0"] == "RuntimeError: unexpected"
+    assert failures["retry0"] == "busy"
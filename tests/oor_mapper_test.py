@@ -0,0 +1,283 @@
+import csv
+import gzip
+import json
+
+import pytest
+
+from oor_benchmark import write_statements
+from oor_mapper import map_many
+
+
+@pytest.fixture(name="input_file", scope="module")
+def fixture_input_file(tmp_path_factory):
+    input_file = tmp_path_factory.mktemp("input") / "statements.jsonl"
+    write_statements(str(input_file), 3000, seed=7)
+    return input_file
+
+
+def map_file(run_mapper, input_file, output_dir, *options):
+    output_dir.mkdir()
+    output_file = output_dir / "output.jsonl"
+    log_file = output_dir / "stats.json"
+    run_mapper("-i", input_file, "-o", output_file, "-l", log_file, *options)
+    return output_file.read_bytes(), json.loads(log_file.read_text())
+
+
+@pytest.mark.parametrize(
+    "options",
+    [[], ["-m", "sqlite"], ["-s"], ["--collapse_replaced"]],
+    ids=["memory", "sqlite", "streaming", "collapse_replaced"],
+)
+def test_workers_match_serial(tmp_path, run_mapper, input_file, options):
+    serial_output, serial_stats = map_file(
+        run_mapper, input_file, tmp_path / "serial", *options
+    )
+    worker_output, worker_stats = map_file(
+        run_mapper,
+        input_file,
+        tmp_path / "workers",
+        "-w",
+        "3",
+        "--chunk_size",
+        "97",
+        *options,
+    )
+    assert serial_output
+    assert worker_output == serial_output
+    assert worker_stats == serial_stats
+
+
+@pytest.mark.parametrize(
+    "options", [[], ["--collapse_replaced"]], ids=["default", "collapse_replaced"]
+)
+def test_streaming_matches_merge(tmp_path, run_mapper, input_file, options):
+    # the same records, written in the order their statements are read
+    merge_output, _ = map_file(run_mapper, input_file, tmp_path / "merge", *options)
+    streaming_output, _ = map_file(
+        run_mapper, input_file, tmp_path / "streaming", "-s", *options
+    )
+    assert merge_output
+    assert sorted(streaming_output.splitlines()) == sorted(merge_output.splitlines())
+
+
+def entity_statement(statement_id, name, replaces=None):
+    raw_data = {
+        "statementID": statement_id,
+        "statementType": "entityStatement",
+        "statementDate": "2024-01-01",
+        "name": name,
+    }
+    if replaces:
+        raw_data["replacesStatements"] = replaces
+    return json.dumps(raw_data) + "\n"
+
+
+@pytest.mark.parametrize(
+    "options",
+    [[], ["-m", "sqlite"], ["-s"], ["-s", "-w", "2", "--chunk_size", "1"]],
+    ids=["memory", "sqlite", "streaming", "streaming_workers"],
+)
+def test_delta_deletes_superseded(tmp_path, run_mapper, options):
+    first_input = tmp_path / "first.jsonl"
+    first_input.write_text(
+        entity_statement("e1", "Old Name") + entity_statement("e2", "Unchanged")
+    )
+    second_input = tmp_path / "second.jsonl"
+    second_input.write_text(
+        entity_statement("e1", "Old Name")
+        + entity_statement("e2", "Unchanged")
+        + entity_statement("e4", "Replaced Before Loaded")
+        + entity_statement("e3", "New Name", ["e1", "e4"])
+    )
+    first_output, first_stats = map_file(
+        run_mapper, first_input, tmp_path / "first", "-f", tmp_path / "first.tsv"
+    )
+    second_output, second_stats = map_file(
+        run_mapper,
+        second_input,
+        tmp_path / "second",
+        "-f",
+        tmp_path / "second.tsv",
+        "-p",
+        tmp_path / "first.tsv",
+        *options,
+    )
+    assert [json.loads(x)["RECORD_ID"] for x in first_output.splitlines()] == [
+        "e1",
+        "e2",
+    ]
+    assert [json.loads(x)["RECORD_ID"] for x in second_output.splitlines()] == ["e3"]
+    deletes = (tmp_path / "second" / "output_deletes.jsonl").read_text().splitlines()
+    assert [json.loads(x)["RECORD_ID"] for x in deletes] == ["e1"]
+    assert second_stats["!delta"]["replaced"]["value"] == ["e1"]
+    assert second_stats["!delta"]["superseded"]["count"] == 2
+    fingerprints = (tmp_path / "second.tsv").read_text().splitlines()
+    assert sorted(x.split("\t")[0] for x in fingerprints) == ["e2", "e3"]
+    assert "!delta" not in first_stats
+
+
+@pytest.mark.parametrize("interests", [None, [], "missing"])
+def test_relationship_without_interests(interests):
+    raw_data = {
+        "statementID": "o1",
+        "statementType": "ownershipOrControlStatement",
+        "subject": {"describedByEntityStatement": "e1"},
+        "interestedParty": {"describedByPersonStatement": "p1"},
+    }
+    if interests != "missing":
+        raw_data["interests"] = interests
+    errors = []
+    mapped_list = map_many([raw_data], errors=errors)
+    assert not errors
+    assert mapped_list[0]["RELATIONSHIPS"] == [
+        {
+            "REL_POINTER_DOMAIN": "OOR",
+            "REL_POINTER_KEY": "p1",
+            "REL_POINTER_ROLE": "interested party",
+        }
+    ]
+
+
+def test_blank_values_left_out():
+    entity = {
+        "statementID": "e1",
+        "statementType": "entityStatement",
+        "statementDate": "2024-01-01",
+        "name": "Acme",
+        "foundingDate": "  ",
+        "dissolutionDate": " ",
+        "identifiers": [{"schemeName": "OpenOwnership Register", "uri": " "}],
+    }
+    person = {
+        "statementID": "p1",
+        "statementType": "personStatement",
+        "statementDate": "2024-01-01",
+        "names": [{"fullName": "Bob"}],
+        "personType": " ",
+    }
+    entity_data, person_data = map_many([entity, person])
+    for attr in ("REGISTRATION_DATE", "dissolutionDate", "LINKS"):
+        assert attr not in entity_data
+    assert "personType" not in person_data
+
+
+def read_record_ids(file_name):
+    return [json.loads(x)["RECORD_ID"] for x in file_name.read_bytes().splitlines()]
+
+
+@pytest.mark.parametrize("options", [[], ["-s"]], ids=["merge", "streaming"])
+def test_partitions_match_whole_run(tmp_path, run_mapper, input_file, options):
+    # the previous snapshot is the first part of the input, so records it had
+    # are superseded by statements in the rest, whichever partition they are in
+    previous_input = tmp_path / "previous.jsonl"
+    previous_input.write_bytes(
+        b"".join(input_file.read_bytes().splitlines(keepends=True)[:2000])
+    )
+    previous_fingerprints = tmp_path / "previous.tsv"
+    map_file(
+        run_mapper, previous_input, tmp_path / "previous", "-f", previous_fingerprints
+    )
+
+    def delta_run(name, *partition):
+        output, _ = map_file(
+            run_mapper,
+            input_file,
+            tmp_path / name,
+            "-f",
+            tmp_path / f"{name}.tsv",
+            "-p",
+            previous_fingerprints,
+            *options,
+            *partition,
+        )
+        deletes = read_record_ids(tmp_path / name / "output_deletes.jsonl")
+        return output.splitlines(), deletes
+
+    whole_output, whole_deletes = delta_run("whole")
+    assert whole_output
+    assert whole_deletes
+    partition_output = []
+    partition_deletes = []
+    for partition_num in (1, 2, 3):
+        output, deletes = delta_run(
+            f"partition_{partition_num}", "--partition", f"{partition_num}/3"
+        )
+        partition_output.extend(output)
+        partition_deletes.extend(deletes)
+    assert sorted(partition_output) == sorted(whole_output)
+    assert sorted(partition_deletes) == sorted(whole_deletes)
+
+
+@pytest.mark.parametrize("date", ["startDate", "endDate"])
+def test_relationship_invalid_date(date):
+    raw_data = {
+        "statementID": "o1",
+        "statementType": "ownershipOrControlStatement",
+        "subject": {"describedByEntityStatement": "e1"},
+        "interestedParty": {"describedByPersonStatement": "p1"},
+        "interests": [{"type": "shareholding"}, {"type": "voting", date: {"y": 2020}}],
+    }
+    errors = []
+    assert map_many([raw_data], errors=errors) == [None]
+    assert [x[1] for x in errors] == ["invalid-date"]
+
+
+def test_run_quarantines_invalid_date(tmp_path, run_mapper):
+    input_file = tmp_path / "statements.jsonl"
+    input_file.write_text(
+        entity_statement("e1", "Acme")
+        + json.dumps(
+            {
+                "statementID": "o1",
+                "statementType": "ownershipOrControlStatement",
+                "subject": {"describedByEntityStatement": "e1"},
+                "interestedParty": {"describedByEntityStatement": "e2"},
+                "interests": [{"type": "shareholding", "startDate": {"y": 2020}}],
+            }
+        )
+        + "\n"
+    )
+    output, _ = map_file(run_mapper, input_file, tmp_path / "output")
+    assert read_record_ids(tmp_path / "output" / "output.jsonl") == ["e1"]
+    assert b"RELATIONSHIPS" in output
+    quarantine = (tmp_path / "output" / "output_quarantine.jsonl").read_text()
+    assert [json.loads(x)["reason"] for x in quarantine.splitlines()] == [
+        "invalid-date"
+    ]
+
+
+def test_map_many_iterator():
+    errors = []
+    mapped_list = map_many(
+        iter([b"{bad\n", entity_statement("e1", "Acme").encode()]), errors=errors
+    )
+    assert mapped_list[0] is None
+    assert mapped_list[1]["RECORD_ID"] == "e1"
+    assert [(x[0], x[1], x[3]) for x in errors] == [(1, "invalid-json", b"{bad\n")]
+
+
+@pytest.mark.parametrize("options", [[], ["-s"]], ids=["merge", "streaming"])
+def test_columnar_leaves_out_superseded(tmp_path, run_mapper, options):
+    input_file = tmp_path / "statements.jsonl"
+    input_file.write_text(
+        entity_statement("e1", "Old Name")
+        + entity_statement("e2", "Unchanged")
+        + entity_statement("e3", "New Name", ["e1"])
+    )
+    columnar_dir = tmp_path / "tables"
+    map_file(
+        run_mapper,
+        input_file,
+        tmp_path / "output",
+        "-f",
+        tmp_path / "fingerprints.tsv",
+        "--columnar_dir",
+        columnar_dir,
+        "--columnar_format",
+        "csv",
+        *options,
+    )
+    output_ids = read_record_ids(tmp_path / "output" / "output.jsonl")
+    assert sorted(output_ids) == ["e2", "e3"]
+    with gzip.open(columnar_dir / "records.csv.gz", "rt", newline="") as table:
+        assert sorted(x["RECORD_ID"] for x in csv.DictReader(table)) == ["e2", "e3"]
@@ -0,0 +1,35 @@
+import pytest
+
+from oor_mapper import sqlite_merge_store
+
+
+def fragment(record_id, name):
+    return {"DATA_SOURCE": "OPEN-OWNERSHIP", "RECORD_ID": record_id, "name": name}
+
+
+@pytest.mark.parametrize("durable", [False, True])
+def test_sqlite_journal(tmp_path, durable):
+    merge_store = sqlite_merge_store(str(tmp_path / "merge.db"), durable=durable)
+    journal_mode = merge_store.conn.execute("PRAGMA journal_mode").fetchone()[0]
+    merge_store.close()
+    assert journal_mode == ("wal" if durable else "off")
+
+
+def test_sqlite_resume(tmp_path):
+    db_path = str(tmp_path / "merge.db")
+    merge_store = sqlite_merge_store(db_path, batch_size=2, durable=True)
+    merge_store.add(fragment("e1", "first"))
+    merge_store.add(fragment("e2", "first"))
+    state = merge_store.save_state(str(tmp_path / "checkpoint"), 2)
+    merge_store.add(fragment("e3", "after the checkpoint"))
+    merge_store.add(fragment("e1", "after the checkpoint"))
+    merge_store.close(remove_file=False)
+
+    merge_store = sqlite_merge_store(db_path, resume=True, durable=True)
+    merge_store.restore_state(state)
+    assert len(merge_store) == 2
+    assert list(merge_store.get_records()) == [
+        fragment("e1", "first"),
+        fragment("e2", "first"),
+    ]
+    merge_store.close()